@@ -0,0 +1,73 @@
+import os
+import threading
+from collections import OrderedDict
+
+# --- CONFIGURATION ---
+# Artifacts are held in memory (on Cloud Run /tmp is RAM as well), so keep the budget modest
+ARTIFACT_CACHE_MAX_BYTES = int(float(os.getenv("ARTIFACT_CACHE_MAX_MB", "64")) * 1024 * 1024)
+
+
+class Artifact:
+    """One generated file. Once uploaded, file_id lets Telegram resend it without the bytes."""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+        self.size = len(data)
+        self.file_id = None
+
+
+class ArtifactCache:
+    """
+    Generated report files keyed by (workbook version, report type, date, formats).
+    Evicts least recently used results once their bytes exceed max_bytes.
+    An empty list is a valid cached result ("no data for that day").
+    """
+
+    def __init__(self, max_bytes=ARTIFACT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached list of Artifacts, or None on a miss"""
+        with self._lock:
+            artifacts = self._entries.get(key)
+            if artifacts is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return artifacts
+
+    def put(self, key, outputs):
+        """Stores (file_name, bytes) pairs and returns them as Artifacts"""
+        artifacts = [Artifact(name, data) for name, data in outputs]
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= sum(a.size for a in old)
+            self._entries[key] = artifacts
+            self._bytes += sum(a.size for a in artifacts)
+            self._evict(keep=key)
+        return artifacts
+
+    def _evict(self, keep):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            key, artifacts = next(iter(self._entries.items()))
+            if key == keep:
+                break
+            del self._entries[key]
+            self._bytes -= sum(a.size for a in artifacts)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "artifact_cache_hits": self.hits,
+                "artifact_cache_misses": self.misses,
+                "artifact_cache_entries": len(self._entries),
+                "artifact_cache_bytes": self._bytes,
+            }
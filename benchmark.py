@@ -0,0 +1,484 @@
+"""
+Offline benchmarks for logic.py on synthetic ward workbooks.
+
+    python benchmark.py loader --rows 50000
+    python benchmark.py render --rows 40
+    python benchmark.py dates --rows 200000
+    python benchmark.py pivots --rows 200000
+    python benchmark.py memory --rows 200000
+    python benchmark.py startup --budget 1500
+    python benchmark.py suite --sizes 1000,10000,100000 --render stub --output results.json
+    python benchmark.py suite --sizes 10000 --baseline results.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import logic
+import render
+
+burmese_digits = str.maketrans("0123456789", "၀၁၂၃၄၅၆၇၈၉")
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts', 'NotoSansMyanmar-Regular.ttf')
+
+UNITS = [f"ခလရ {n}" for n in range(1, 31)] + [f"တပ {n}" for n in range(1, 11)]
+ROOMS = [f"{w}{n}" for w in "ABC" for n in range(1, 6)]
+RANKS = ["တပ်သား", "တပ်ကြပ်", "ဒုအရာခံ", "ဗိုလ်", "ဗိုလ်ကြီး"]
+REGIONS = ["ရန်ကုန်", "မန္တလေး", "ပဲခူး", "စစ်ကိုင်း"]
+COMMANDS = ["ရကတ", "မပခ", "တပခ", "အနခ"]
+DIAGNOSES = ["EAMI", "EASPW", "EAGSW", "Malaria", "Fever", "Pneumonia", "Fracture", "Diarrhoea"]
+
+
+def burmese_date(dt):
+    return f"{dt.day}-{dt.month}-{dt.year}".translate(burmese_digits)
+
+
+def make_ward_dataframe(rows, seed=0, end_date=datetime(2025, 12, 31), days=120):
+    """Builds a DataFrame shaped like the ward workbook, with Burmese-digit dates"""
+    rnd = random.Random(seed)
+    records = []
+    for i in range(rows):
+        admitted = end_date - timedelta(days=rnd.randrange(days))
+        left = admitted + timedelta(days=rnd.randrange(1, 15))
+        status = rnd.random()
+        discharge, transfer = None, None
+        if status < 0.25:
+            discharge = burmese_date(left)
+        elif status < 0.35:
+            transfer = burmese_date(left)
+        elif status < 0.40:
+            discharge = rnd.choice(["exp", "die"])
+            transfer = burmese_date(left)
+
+        records.append({
+            "ကိုယ်ပိုင်အမှတ်": rnd.choice(["ကြည်း", "ရေ", "လေ", "မိသားစု"]) + f"-{100000 + i}",
+            "အဆင့်": rnd.choice(RANKS),
+            "အမည်": f"လူနာ {i}",
+            "တော်စပ်ပုံ": rnd.choice(["ကိုယ်တိုင်", "ဇနီး", "သား", "သမီး"]),
+            "မှီခိုအမည်": f"မှီခို {i}",
+            "အသက်": rnd.randrange(18, 60),
+            "စစ်သက်": rnd.randrange(1, 30),
+            "တပ်": rnd.choice(UNITS),
+            "တိုင်း": rnd.choice(REGIONS),
+            "ကွပ်ကဲမှု့": rnd.choice(COMMANDS),
+            "ဖြစ်စဥ်‌နေရာ": rnd.choice(REGIONS),
+            "ဖြစ်စဉ်ရက်စွဲ": burmese_date(admitted - timedelta(days=1)),
+            "ရောဂါ(အဂ်လိပ်)": rnd.choice(DIAGNOSES),
+            "ရောဂါ(မြန်မာ)": "ရောဂါ",
+            "ဆေးရုံတက်ရက်": burmese_date(admitted),
+            "ဆေးရုံဆင်းရက်": discharge,
+            "ဆေးရုံပြောင်းရက်": transfer,
+            "မှတ်ချက်": None,
+            "room": rnd.choice(ROOMS),
+        })
+    return pd.DataFrame(records)
+
+
+def write_workbook(path, rows, seed=0):
+    make_ward_dataframe(rows, seed).to_excel(path, index=False, engine='xlsxwriter')
+    return path
+
+
+def timed(fn, repeat=1):
+    """Returns the best wall-clock time of `repeat` calls, in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def clear_memory_cache():
+    with logic._df_cache_lock:
+        logic._df_cache.clear()
+
+
+# --- BENCHMARKS ---
+
+def bench_loader(args, workdir):
+    """Cold xlsx parse vs pickle sidecar load vs in-process LRU hit"""
+    logic.SIDECAR_DIR = os.path.join(workdir, "sidecars")
+    xlsx = write_workbook(os.path.join(workdir, "ward.xlsx"), args.rows)
+
+    cold = timed(lambda: pd.read_excel(xlsx))
+
+    clear_memory_cache()
+    logic.load_dataframe(xlsx)  # writes the sidecar
+
+    def sidecar_load():
+        clear_memory_cache()
+        logic.load_dataframe(xlsx)
+    sidecar = timed(sidecar_load, args.repeat)
+
+    memory = timed(lambda: logic.load_dataframe(xlsx), args.repeat)
+
+    print(f"rows={args.rows}")
+    print(f"  cold xlsx parse : {cold * 1000:10.1f} ms")
+    print(f"  sidecar load    : {sidecar * 1000:10.1f} ms")
+    print(f"  memory hit      : {memory * 1000:10.1f} ms  (includes content hash)")
+
+
+def bench_render(args, workdir):
+    """Per-image latency of each PNG backend on a tatsin-sized table and a pivot"""
+    font_path = FONT_PATH
+    df = make_ward_dataframe(args.rows)
+    table = logic.build_custom_table(df)
+    pivot = pd.pivot_table(df, index='room', columns='တပ်', values='ကိုယ်ပိုင်အမှတ်', aggfunc='count', fill_value=0)
+
+    backends = [
+        render.WkhtmlRenderer(font_path, args.wkhtml),
+        # Shaping is not needed for timing; without libraqm Pillow falls back to basic layout
+        render.PillowRenderer(font_path, require_shaping=False),
+    ]
+    print(f"table rows={len(table)}, pivot={pivot.shape}")
+    for backend in backends:
+        try:
+            warm = timed(backend.warm_up)
+            out = os.path.join(workdir, f"{backend.name}.png")
+            t_table = timed(lambda: backend.render_table(table, "ဆေးရုံ တက်/ဆင်း/ပြောင်း", out, index=False), args.repeat)
+            t_pivot = timed(lambda: backend.render_table(pivot, "ဆေးရုံတက်နေရာ အခြေပြဇယား", out), args.repeat)
+        except Exception as e:
+            print(f"  {backend.name:7}: unavailable ({e})")
+            continue
+        print(f"  {backend.name:7}: warm-up {warm * 1000:8.1f} ms | table {t_table * 1000:8.1f} ms/image | pivot {t_pivot * 1000:8.1f} ms/image")
+
+
+def bench_dates(args, workdir):
+    """Row-wise substring matching vs parsed-date masks vs the per-version date index (correctness: tests/test_dates.py)"""
+    df = make_ward_dataframe(args.rows)
+    wanted = df["ဆေးရုံတက်ရက်"].iloc[0]
+
+    def substring():
+        return df[df[logic.DATE_COLUMNS].astype(str).apply(lambda row: row.str.contains(wanted, na=False)).any(axis=1)]
+
+    plain = df.copy()
+    plain.attrs.clear()
+    versioned = df.copy()
+    logic._mark_loaded(versioned, "bench")
+
+    t_substring = timed(substring)
+    t_mask = timed(lambda: logic.rows_on_date(plain, wanted), args.repeat)
+    t_index_build = timed(lambda: logic.rows_on_date(versioned, wanted))
+    t_index_hit = timed(lambda: logic.rows_on_date(versioned, wanted), args.repeat)
+
+    print(f"rows={args.rows}, matched={len(substring())} (substring) / {len(logic.rows_on_date(plain, wanted))} (exact)")
+    print(f"  substring apply : {t_substring * 1000:10.1f} ms")
+    print(f"  parsed mask     : {t_mask * 1000:10.1f} ms  ({t_substring / t_mask:.0f}x)")
+    print(f"  index build     : {t_index_build * 1000:10.1f} ms  (once per workbook version)")
+    print(f"  index lookup    : {t_index_hit * 1000:10.1f} ms  ({t_substring / t_index_hit:.0f}x)")
+
+
+def pivot_table_reports(df):
+    """The sitchar and room pivots the way they were built before the aggregation layer"""
+    admitted = df[df[['ဆေးရုံဆင်းရက်', 'ဆေးရုံပြောင်းရက်']].isna().all(axis=1)].copy()
+    admitted['group'] = admitted['ရောဂါ(အဂ်လိပ်)'].str.contains(logic.OPERATION_PATTERN, case=False, na=False).map({True: 'စဆရ', False: 'အခြား'})
+    pivots = []
+    for by in ['group', 'room']:
+        pivot = pd.pivot_table(admitted, index=by, columns='တပ်', values='ကိုယ်ပိုင်အမှတ်', aggfunc='count', fill_value=0)
+        pivot.loc['ပေါင်း'] = pivot.sum()
+        pivot['ပေါင်း'] = pivot.sum(axis=1)
+        pivot.index.name = None
+        pivot.columns.name = None
+        pivots.append(pivot)
+    return pivots
+
+
+def aggregate_reports(df):
+    counts = logic.admitted_counts(df)
+    counts = counts[counts['unit'].notna()]
+    return [logic.admitted_pivot(counts, 'group'), logic.admitted_pivot(counts[counts['room'].notna()], 'room')]
+
+
+def bench_pivots(args, workdir):
+    """sitchar + room pivots: pd.pivot_table per request vs shared per-version counts vs appended rows (correctness: tests/test_pivots.py)"""
+    df = make_ward_dataframe(args.rows)
+    appended = max(args.rows // 100, 1)
+    base = df.iloc[:-appended].reset_index(drop=True)
+
+    def versioned(frame, version):
+        frame = frame.copy()
+        logic._mark_loaded(frame, version)
+        return frame
+
+    counter = iter(range(10 ** 9))
+    t_pivot_table = timed(lambda: pivot_table_reports(df), args.repeat)
+    t_cold = timed(lambda: aggregate_reports(versioned(df, f"cold-{next(counter)}")), args.repeat)
+    current = versioned(df, "current")
+    aggregate_reports(current)
+    t_hit = timed(lambda: aggregate_reports(current), args.repeat)
+
+    def append_only():
+        old = versioned(base, f"base-{next(counter)}")
+        logic.admitted_counts(old)
+        new = versioned(df, f"new-{next(counter)}")
+        start = time.perf_counter()
+        aggregate_reports(new)
+        return time.perf_counter() - start
+    t_append = min(append_only() for _ in range(args.repeat))
+
+    print(f"rows={args.rows}, appended={appended}")
+    print(f"  pivot_table x2    : {t_pivot_table * 1000:10.1f} ms")
+    print(f"  new version       : {t_cold * 1000:10.1f} ms  ({t_pivot_table / t_cold:.1f}x)")
+    print(f"  appended rows     : {t_append * 1000:10.1f} ms  ({t_pivot_table / t_append:.1f}x)")
+    print(f"  same version      : {t_hit * 1000:10.1f} ms  ({t_pivot_table / t_hit:.0f}x)")
+
+
+def object_custom_table(df):
+    """build_custom_table as it was before the compact representation: whole-frame copies and fillna"""
+    df = df.reset_index(drop=True)
+    result = pd.DataFrame()
+
+    result["စဉ်"] = [logic.to_burmese_number(i+1) for i in range(len(df))]
+    result["ကိုယ်ပိုင်အမှတ်"] = df['ကိုယ်ပိုင်အမှတ်']
+    result["အဆင့်"] = df["အဆင့်"]
+
+    pattern = r"ကြည်း|ရေ|လေ|အန်|N"
+    result["လူနာအမျိုး အစား"] = df["ကိုယ်ပိုင်အမှတ်"].str.contains(pattern, case=False, na=False).map({True: "ရှိ", False: "ခြား"})
+
+    result["အမည်"] = df["အမည်"]
+    result["တော်စပ်ပုံ"] = df["တော်စပ်ပုံ"]
+    result["မှီခို အမည်"] = df["မှီခိုအမည်"]
+    result["အသက်"] = df["အသက်"]
+    result["စစ်သက်"] = df["စစ်သက်"]
+    result["တပ်"] = df["တပ်"]
+    result["တိုင်း"] = df["တိုင်း"]
+    result["ကွပ်ကဲမှု"] = df["ကွပ်ကဲမှု့"] 
+    result["ဖြစ်စဉ်နေရာ"] = df["ဖြစ်စဥ်‌နေရာ"]
+    result["ဖြစ်စဉ်ရက်စွဲ"] = df["ဖြစ်စဉ်ရက်စွဲ"]
+    result["ရောဂါ(အဂ်လိပ်)"] = df["ရောဂါ(အဂ်လိပ်)"]
+    result["ရောဂါ(မြန်မာ)"] = df["ရောဂါ(မြန်မာ)"]
+    result["တက်ရောက် သည့်ဆေးရုံ"] = "မဆခွဲ ၂/၅"
+    result["ဆေးရုံတက် ရက်စွဲ"] = df["ဆေးရုံတက်ရက်"]
+
+    is_dead = df["ဆေးရုံဆင်းရက်"].str.contains(r"exp|die", case=False, na=False)
+    result["ဆေးရုံဆင်း ရက်စွဲ"] = df["ဆေးရုံဆင်းရက်"].where(~is_dead, "")
+    result["ဆေးရုံပြောင်း ရက်စွဲ"] = df["ဆေးရုံပြောင်းရက်"].where(~is_dead, "")
+    result["သေဆုံး ရက်စွဲ"] = df["ဆေးရုံပြောင်းရက်"].where(is_dead, "")
+    result["မှတ်ချက်"] = df["မှတ်ချက်"]
+
+    return result.fillna('')
+
+
+def bench_memory(args, workdir):
+    """Object columns vs the compact (categorical) representation: memory, sidecar size/load and table build time"""
+    raw = make_ward_dataframe(args.rows)
+    compact = logic.compact_dataframe(raw.copy())
+    day = raw["ဆေးရုံတက်ရက်"].iloc[0]
+    raw_rows = logic.rows_on_date(raw, day)
+    compact_rows = logic.rows_on_date(compact, day)
+
+    print(f"rows={args.rows}, rows on {day}: {len(raw_rows)}")
+    for label, frame, rows, build in [
+        ("object ", raw, raw_rows, object_custom_table),
+        ("compact", compact, compact_rows, logic.build_custom_table),
+    ]:
+        memory = frame.memory_usage(deep=True).sum()
+        sidecar = os.path.join(workdir, f"{label.strip()}.pkl")
+        frame.to_pickle(sidecar)
+        t_load = timed(lambda: pd.read_pickle(sidecar), args.repeat)
+        t_day = timed(lambda: build(rows), args.repeat)
+        t_sheet = timed(lambda: build(frame), 1)
+        print(f"  {label}: {memory / 2**20:7.1f} MiB in memory | sidecar {os.path.getsize(sidecar) / 2**20:6.1f} MiB, "
+              f"load {t_load * 1000:7.1f} ms | table: day {t_day * 1000:6.1f} ms, whole sheet {t_sheet * 1000:7.1f} ms")
+
+
+def import_profile(stderr):
+    """Parses `python -X importtime` output into (cumulative us, depth, module) rows"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(cumulative), depth, name.strip()))
+    return rows
+
+
+def bench_startup(args, workdir):
+    """Cold `import main` in a fresh interpreter, checked against the cold-start budget"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, TELEGRAM_TOKEN=os.environ.get("TELEGRAM_TOKEN", "0:benchmark"))
+    command = [sys.executable, "-X", "importtime", "-c", "import main"]
+
+    runs = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=here, env=env, capture_output=True, text=True, check=True)
+        runs.append(time.perf_counter() - start)
+
+    # main itself and the packages it pulls in directly
+    profile = [row for row in import_profile(result.stderr) if row[1] <= 1]
+    best = min(runs)
+    print(f"interpreter + import main: best {best * 1000:.0f} ms, worst {max(runs) * 1000:.0f} ms (budget {args.budget:.0f} ms)")
+    for cumulative, depth, name in sorted(profile, reverse=True)[:12]:
+        print(f"  {cumulative / 1000:8.1f} ms  {'  ' * depth}{name}")
+    if best * 1000 > args.budget:
+        raise SystemExit(f"Cold start {best * 1000:.0f} ms is over the {args.budget:.0f} ms budget")
+
+
+class StubRenderer(render.Renderer):
+    """Writes a fixed 1x1 PNG, so the suite measures the pipeline rather than rasterizing"""
+    name = "stub"
+
+    def render_table(self, frame, title, output, index=True):
+        from PIL import Image
+        if not hasattr(self, "_png"):
+            buf = io.BytesIO()
+            Image.new("RGB", (1, 1), "white").save(buf, format="PNG")
+            self._png = buf.getvalue()
+        if isinstance(output, str):
+            with open(output, "wb") as f:
+                f.write(self._png)
+        else:
+            output.write(self._png)
+
+
+def suite_renderer(args):
+    if args.render == "stub":
+        return StubRenderer()
+    if args.render == "pillow":
+        return render.PillowRenderer(FONT_PATH, require_shaping=False)
+    return render.WkhtmlRenderer(FONT_PATH, args.wkhtml)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def bench_suite(args, workdir):
+    """
+    Every public entry point and generator, per report type and format, on workbooks of several sizes.
+    The first call of each case includes whatever per-version work it triggers; `best` is the warm time.
+    """
+    renderer = suite_renderer(args)
+    renderer.warm_up()
+    # process_* look the renderer up by paths; hand them the chosen one instead
+    logic.get_renderer = lambda font_path, wkhtmltopdf_path: renderer
+    logic.SIDECAR_DIR = os.path.join(workdir, "sidecars")
+
+    results = []
+
+    def record(rows, name, fn, **case):
+        start = time.perf_counter()
+        fn()
+        first = time.perf_counter() - start
+        best = min(first, timed(fn, args.repeat - 1)) if args.repeat > 1 else first
+        result = {
+            "rows": rows, "case": name, **case,
+            "first_s": round(first, 6), "best_s": round(best, 6),
+            "rows_per_s": round(rows / best) if best else None,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+        results.append(result)
+        print(f"  {name:28} {json.dumps(case, ensure_ascii=False):42} first {first * 1000:9.1f} ms  best {best * 1000:9.1f} ms  "
+              f"{result['rows_per_s'] or 0:>12,} rows/s  peak RSS {result['peak_rss_mb']:7.1f} MiB")
+
+    for rows in args.sizes:
+        xlsx = write_workbook(os.path.join(workdir, f"ward_{rows}.xlsx"), rows)
+        clear_memory_cache()
+        df = pd.read_excel(xlsx)
+        # The busiest admission day, so tatsin has real work
+        day = df["ဆေးရုံတက်ရက်"].mode()[0]
+        print(f"rows={rows}, date={day}, renderer={renderer.name}")
+
+        record(rows, "calculate_admitted_df_len", lambda: logic.calculate_admitted_df_len(xlsx))
+        df = logic.load_dataframe(xlsx)
+        for formats in (['e'], ['p'], ['e', 'p']):
+            for name, gen in logic.GENERATORS.items():
+                record(rows, f"_gen_{name}", lambda: gen(df, day, renderer, formats), formats="".join(formats))
+            for name in logic.GENERATORS:
+                record(rows, "process_specific_report",
+                       lambda: logic.process_specific_report(xlsx, day, FONT_PATH, args.wkhtml, name, formats),
+                       report_type=name, formats="".join(formats))
+        record(rows, "process_data", lambda: logic.process_data(xlsx, day, FONT_PATH, args.wkhtml))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "renderer": renderer.name,
+            "repeat": args.repeat,
+            "sizes": args.sizes,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"wrote {args.output}")
+    if args.baseline:
+        compare_results(args.baseline, results)
+
+
+def compare_results(baseline_path, results):
+    """Prints best-time ratios against an earlier suite run"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    def key(r):
+        return tuple(sorted((k, str(v)) for k, v in r.items() if k in ("rows", "case", "report_type", "formats")))
+
+    before = {key(r): r for r in baseline["results"]}
+    print(f"vs {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    for r in results:
+        old = before.get(key(r))
+        if old and r["best_s"]:
+            print(f"  {r['rows']:>7} {r['case']:28} {r.get('report_type', ''):8} {r.get('formats', ''):3} "
+                  f"{old['best_s'] * 1000:9.1f} -> {r['best_s'] * 1000:9.1f} ms  ({old['best_s'] / r['best_s']:.2f}x)")
+
+
+BENCHMARKS = {
+    "loader": bench_loader,
+    "render": bench_render,
+    "dates": bench_dates,
+    "pivots": bench_pivots,
+    "memory": bench_memory,
+    "startup": bench_startup,
+    "suite": bench_suite,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--wkhtml", default='/usr/bin/wkhtmltoimage')
+    # Cold-start budget for `import main`; before lazy imports it was ~6.5 s, now ~0.7 s
+    parser.add_argument("--budget", type=float, default=1500, help="startup budget in ms")
+    parser.add_argument("--sizes", type=lambda v: [int(n) for n in v.split(",")], default=[1000, 10000, 100000],
+                        help="suite workbook sizes, comma separated")
+    parser.add_argument("--render", choices=["stub", "pillow", "wkhtml"], default="stub", help="suite PNG backend")
+    parser.add_argument("--output", help="write suite results as JSON")
+    parser.add_argument("--baseline", help="compare suite results with an earlier JSON run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        BENCHMARKS[args.benchmark](args, workdir)
+
+
+if __name__ == "__main__":
+    main()
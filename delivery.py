@@ -0,0 +1,188 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from telegram import InputMediaDocument
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import inc, registry, span
+
+# --- CONFIGURATION ---
+# Telegram allows about 30 messages/s per bot, about 1/s in one private chat (short bursts are
+# tolerated) and 20/min in a group. The buckets stay a little below that.
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_GROUP_RATE = 20 / 60
+TELEGRAM_GROUP_BURST = 5
+# Times a request is re-sent after a RetryAfter before the error reaches the handler
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+# Per-chat buckets kept; the least recently used chat is forgotten beyond this
+CHAT_BUCKETS_MAX = 10000
+# Telegram puts at most ten items in one album
+MEDIA_GROUP_MAX = 10
+# rate_limit_args for calls that may be dropped rather than wait, such as progress edits
+BEST_EFFORT = "best_effort"
+
+
+class Throttled(Exception):
+    """A BEST_EFFORT call was dropped because its chat or the bot is at the rate limit"""
+
+
+class TokenBucket:
+    """
+    Refills `rate` tokens per second up to `capacity`. Sends reserve tokens up front and may
+    run the bucket into debt, so concurrent callers queue up in the order they asked.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost=1):
+        """Seconds until `cost` tokens are available, without taking them"""
+        self._refill()
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+    def reserve(self, cost=1):
+        """Takes `cost` tokens and returns how many seconds to wait before sending"""
+        self._refill()
+        self.tokens -= cost
+        return max(0.0, -self.tokens / self.rate)
+
+    def pause(self, seconds):
+        """Holds back everything in this bucket for at least `seconds` (after a RetryAfter)"""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """
+    Throttles every Bot API call that targets a chat through a global bucket and that chat's
+    bucket, and retries a RetryAfter after the wait Telegram asks for.
+    Plugged in with ApplicationBuilder.rate_limiter, so handlers need no changes.
+
+    `rate_limit_args` on a single call may set its own number of retries, or be BEST_EFFORT:
+    then the call raises Throttled instead of waiting and is not retried.
+    """
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE,
+                 chat_burst=TELEGRAM_CHAT_BURST, max_retries=TELEGRAM_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chats = OrderedDict()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Negative ids and @usernames are groups and channels
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(TELEGRAM_GROUP_RATE, TELEGRAM_GROUP_BURST)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+            while len(self._chats) > CHAT_BUCKETS_MAX:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _throttle(self, chat_bucket, cost):
+        # Both reservations happen before the first await, so they stay consistent between tasks
+        wait = self.global_bucket.reserve(cost)
+        if chat_bucket is not None:
+            wait = max(wait, chat_bucket.reserve())
+        if wait > 0:
+            inc("telegram_throttled_total")
+            registry.observe("telegram.throttle", wait)
+            await asyncio.sleep(wait)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if isinstance(chat_id, str) and chat_id.lstrip("-").isdigit():
+            chat_id = int(chat_id)
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+        # An album is one message in its chat but one per item towards the bot's overall limit
+        cost = (len(data.get("media") or ()) or 1) if endpoint == "sendMediaGroup" else 1
+
+        if rate_limit_args == BEST_EFFORT:
+            # Only spare capacity: a token stays for the next message that has to go out
+            if self.global_bucket.delay(cost + 1) > 0 or (chat_bucket and chat_bucket.delay(2) > 0):
+                inc("telegram_dropped_total", endpoint=endpoint)
+                raise Throttled(endpoint)
+            max_retries = 0
+        else:
+            max_retries = self.max_retries if rate_limit_args is None else rate_limit_args
+
+        for attempt in range(max_retries + 1):
+            await self._throttle(chat_bucket, cost)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                delay = e.retry_after
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                inc("telegram_retry_after_total", endpoint=endpoint)
+                # Later sends to the same chat wait too instead of hitting the limit again
+                (chat_bucket or self.global_bucket).pause(delay)
+                if attempt == max_retries:
+                    raise
+                print(f"⏳ Telegram flood wait on {endpoint}: retrying in {delay}s")
+
+
+async def send_documents(bot, chat_id, artifacts, caption=None):
+    """
+    Sends artifacts as documents, up to ten per album; a lone file goes with send_document.
+    Files Telegram already has are resent by file_id, and fresh uploads record theirs.
+    The caption goes under the last file.
+    """
+    for start in range(0, len(artifacts), MEDIA_GROUP_MAX):
+        batch = artifacts[start:start + MEDIA_GROUP_MAX]
+        last = start + len(batch) == len(artifacts)
+        for artifact in batch:
+            inc("uploads_total", kind="file_id" if artifact.file_id else "bytes")
+
+        if len(batch) == 1:
+            artifact = batch[0]
+            with span("telegram.send_document"):
+                message = await bot.send_document(
+                    chat_id=chat_id,
+                    document=artifact.file_id or artifact.data,
+                    filename=artifact.name,
+                    caption=caption if last else None
+                )
+            messages = [message]
+        else:
+            media = [
+                InputMediaDocument(
+                    artifact.file_id or artifact.data,
+                    filename=artifact.name,
+                    caption=caption if last and i == len(batch) - 1 else None
+                )
+                for i, artifact in enumerate(batch)
+            ]
+            with span("telegram.send_media_group"):
+                messages = await bot.send_media_group(chat_id=chat_id, media=media)
+
+        for artifact, message in zip(batch, messages):
+            if artifact.file_id is None and message.document:
+                artifact.file_id = message.document.file_id
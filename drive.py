@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from metrics import span, inc
+
+# --- CONFIGURATION ---
+SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
+CACHE_DIR = os.getenv("DRIVE_CACHE_DIR", "/tmp/drive_cache")
+# Seconds a downloaded copy is trusted before Drive metadata is checked again
+CACHE_MAX_AGE = float(os.getenv("DRIVE_CACHE_MAX_AGE", "60"))
+# Media is streamed to disk in chunks of this size instead of one in-memory blob
+DOWNLOAD_CHUNK_SIZE = int(float(os.getenv("DRIVE_CHUNK_MB", "8")) * 1024 * 1024)
+HTTP_TIMEOUT = 60
+
+
+def build_drive_service():
+    """
+    Drive v3 client from the bundled (static) discovery document.
+    Credentials are resolved once and refreshed by the transport when they expire.
+    httplib2 connections are not thread-safe, so every worker thread gets its own
+    keep-alive connection, reused for all of that thread's requests.
+    """
+    # Imported here: googleapiclient is slow to import and only needed once a report is requested
+    import google.auth
+    import google_auth_httplib2
+    import httplib2
+    from googleapiclient.discovery import build
+    from googleapiclient.http import HttpRequest
+
+    creds, _ = google.auth.default(scopes=SCOPES)
+    local = threading.local()
+
+    def thread_http():
+        http = getattr(local, "http", None)
+        if http is None:
+            http = local.http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        return http
+
+    def build_request(http, *args, **kwargs):
+        return HttpRequest(thread_http(), *args, **kwargs)
+
+    return build('drive', 'v3', http=thread_http(), requestBuilder=build_request,
+                 static_discovery=True, cache_discovery=False)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_drive_service():
+    """Process-wide Drive client, built on first use"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = build_drive_service()
+        return _service
+
+
+class CachedFile:
+    def __init__(self, path, version, modified_time, checked_at):
+        self.path = path
+        self.version = version
+        self.modified_time = modified_time
+        self.checked_at = checked_at
+
+
+class WorkbookCache:
+    """
+    Keeps the latest copy of Drive files on local disk.
+
+    Within `max_age` seconds of the last check the local copy is returned as is.
+    After that only the file metadata (md5Checksum / modifiedTime) is fetched,
+    and the media is downloaded again only when that version has changed.
+    Each version is stored under its own name, so a path handed out earlier
+    stays valid while a newer version is being downloaded.
+    """
+
+    def __init__(self, service_factory=get_drive_service, cache_dir=CACHE_DIR,
+                 max_age=CACHE_MAX_AGE, clock=time.monotonic):
+        self.service_factory = service_factory
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.clock = clock
+        self._entries = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_for(self, file_id):
+        with self._locks_guard:
+            return self._locks.setdefault(file_id, threading.Lock())
+
+    def get(self, file_id):
+        """Returns a CachedFile whose path holds the current content of file_id."""
+        with self._lock_for(file_id):
+            entry = self._entries.get(file_id)
+            now = self.clock()
+            if entry and now - entry.checked_at < self.max_age and os.path.exists(entry.path):
+                inc("cache_requests_total", cache="workbook", result="fresh")
+                return entry
+
+            with span("drive.metadata"):
+                service = self.service_factory()
+                meta = service.files().get(fileId=file_id, fields='md5Checksum,modifiedTime').execute()
+            version = meta.get('md5Checksum') or meta.get('modifiedTime')
+
+            if entry and version and entry.version == version and os.path.exists(entry.path):
+                inc("cache_requests_total", cache="workbook", result="unchanged")
+                entry.checked_at = now
+                return entry
+
+            inc("cache_requests_total", cache="workbook", result="download")
+            with span("drive.download"):
+                path = self._download(service, file_id, version)
+            new_entry = CachedFile(path, version, meta.get('modifiedTime'), now)
+            self._entries[file_id] = new_entry
+            self._prune(file_id, keep=[path, entry.path if entry else None])
+            return new_entry
+
+    def invalidate(self, file_id=None):
+        """Forces the next get() to check Drive again."""
+        if file_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(file_id, None)
+
+    def _download(self, service, file_id, version):
+        from googleapiclient.http import MediaIoBaseDownload
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Drive versions are hex checksums or ISO timestamps; keep the name filesystem-safe
+        safe_version = "".join(c for c in str(version) if c.isalnum()) or "latest"
+        path = os.path.join(self.cache_dir, f"{file_id}_{safe_version}.xlsx")
+        tmp_path = f"{path}.{threading.get_ident()}.part"
+
+        request = service.files().get_media(fileId=file_id)
+        try:
+            with open(tmp_path, 'wb') as f:
+                downloader = MediaIoBaseDownload(f, request, chunksize=DOWNLOAD_CHUNK_SIZE)
+                done = False
+                while not done:
+                    _, done = downloader.next_chunk(num_retries=3)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        # Jobs read the shared copy concurrently; nobody should write to it
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, path)
+        return path
+
+    def _prune(self, file_id, keep):
+        # Keep the current and the previous version (a reader may still hold its path)
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(f"{file_id}_") and path not in keep and not name.endswith(".part"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+# Process-wide cache, survives across requests inside one instance
+workbook_cache = WorkbookCache()
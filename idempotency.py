@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# --- CONFIGURATION ---
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", "10000"))
+# Optional SQLite file so replays are still recognised after an instance restart
+UPDATE_DEDUP_DB = os.getenv("UPDATE_DEDUP_DB", "")
+# Telegram gives up retrying long before this
+UPDATE_DEDUP_RETENTION = 24 * 3600
+
+
+class UpdateDeduplicator:
+    """
+    Bounded memory of recently seen Telegram update_ids.
+    Telegram re-sends an update when the webhook was slow to answer; those replays are dropped here.
+    """
+
+    def __init__(self, capacity=UPDATE_DEDUP_SIZE, db_path=UPDATE_DEDUP_DB):
+        self.capacity = capacity
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self.accepted = 0
+        self.duplicates = 0
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS seen_updates (update_id INTEGER PRIMARY KEY, seen_at REAL)")
+            self._db.commit()
+
+    def is_duplicate(self, update_id):
+        """Records update_id and returns True if it had been seen before"""
+        with self._lock:
+            if update_id in self._seen or self._in_db(update_id):
+                self._seen[update_id] = True
+                self._seen.move_to_end(update_id)
+                self.duplicates += 1
+                return True
+
+            self._seen[update_id] = True
+            while len(self._seen) > self.capacity:
+                self._seen.popitem(last=False)
+            self._store(update_id)
+            self.accepted += 1
+            return False
+
+    def stats(self):
+        return {"updates_accepted": self.accepted, "duplicate_updates_suppressed": self.duplicates}
+
+    def _in_db(self, update_id):
+        if self._db is None:
+            return False
+        row = self._db.execute("SELECT 1 FROM seen_updates WHERE update_id = ?", (update_id,)).fetchone()
+        return row is not None
+
+    def _store(self, update_id):
+        if self._db is None:
+            return
+        now = time.time()
+        self._db.execute("INSERT OR IGNORE INTO seen_updates (update_id, seen_at) VALUES (?, ?)", (update_id, now))
+        self._inserts += 1
+        if self._inserts % 1000 == 0:
+            self._db.execute("DELETE FROM seen_updates WHERE seen_at < ?", (now - UPDATE_DEDUP_RETENTION,))
+        self._db.commit()
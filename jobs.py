@@ -0,0 +1,104 @@
+import asyncio
+import traceback
+from metrics import inc
+
+
+class Job:
+    """
+    One unit of queued work. Everyone who asked for the same key while it is
+    in flight is a subscriber and gets the same result.
+
+    Subscribers are objects with async `progress(text)` and `fail(exc)` methods;
+    delivering the result is up to the job's `work` coroutine (see `close`).
+    """
+
+    def __init__(self, queue, key, work):
+        self.queue = queue
+        self.key = key
+        self.work = work
+        self.subscribers = []
+        self.closed = False
+
+    async def progress(self, text):
+        for subscriber in list(self.subscribers):
+            try:
+                await subscriber.progress(text)
+            except Exception as e:
+                print(f"Progress update failed for job {self.key}: {e}")
+
+    def close(self):
+        """Stops merging new duplicates into this job and returns everyone waiting for its result"""
+        self.closed = True
+        self.queue._forget(self)
+        return list(self.subscribers)
+
+
+class JobQueue:
+    """
+    In-process asyncio job queue with a fixed number of workers.
+    Submitting a key that is already queued or running attaches to that job instead of running it twice.
+    """
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._queue = None
+        self._tasks = []
+        self._inflight = {}
+
+    def start(self):
+        """Starts the workers on the running event loop"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def join(self):
+        """Waits until every submitted job has finished"""
+        await self._queue.join()
+
+    async def submit(self, key, work, subscriber):
+        """Queues `work(job)` under key; returns (job, is_new)"""
+        job = self._inflight.get(key)
+        if job is not None and not job.closed:
+            inc("jobs_merged_total")
+            job.subscribers.append(subscriber)
+            await subscriber.progress("Same report is already being generated, you'll get it too.")
+            return job, False
+
+        job = Job(self, key, work)
+        job.subscribers.append(subscriber)
+        self._inflight[key] = job
+        await self._queue.put(job)
+        ahead = self._queue.qsize() - 1
+        if ahead > 0:
+            await subscriber.progress(f"Queued, {ahead} job(s) ahead.")
+        return job, True
+
+    def _forget(self, job):
+        if self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await job.work(job)
+                inc("jobs_total", result="ok")
+            except Exception as e:
+                inc("jobs_total", result="error")
+                print(f"🔥 JOB ERROR {job.key}:\n{traceback.format_exc()}")
+                if not job.closed:
+                    for subscriber in job.close():
+                        try:
+                            await subscriber.fail(e)
+                        except Exception as notify_error:
+                            print(f"Failure notice failed for job {job.key}: {notify_error}")
+            finally:
+                self._forget(job)
+                self._queue.task_done()
@@ -0,0 +1,433 @@
+"""
+Offline load test of the FastAPI webhook, with local stand-ins for the Telegram Bot API,
+Google Drive and the LLM/session services (each with a configurable latency).
+
+    python loadtest.py --concurrency 1,8,32 --requests 200
+    python loadtest.py --mix gen=1 --upload-latency 0.5 --output webhook.json
+    python loadtest.py --mix chat=1 --llm-latency 2 --concurrency 1,16,64
+
+Synthetic updates (/gen variants, action_gen_today callbacks, free-text chat) are POSTed to
+`telegram_webhook` in-process. For every concurrency level it reports webhook latency
+percentiles, throughput, error rates and how long the queued report jobs took to drain.
+
+Needs httpx on top of the bot's requirements: pip install -r requirements-dev.txt
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+FIRST_USER_ID = 100000
+
+# main.py reads these at import
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:loadtest")
+os.environ.setdefault("ADMIN_ID", str(FIRST_USER_ID))
+os.environ.setdefault("SESSION_BACKEND", "memory")
+os.environ.setdefault("STARTUP_WARMUP", "0")
+
+import httpx
+import httplib2
+import numpy as np
+from googleapiclient.http import HttpRequest
+from telegram.request import BaseRequest
+
+import benchmark
+import logic
+import main
+from metrics import registry
+
+
+# --- TELEGRAM BOT API STAND-IN ---
+
+UPLOAD_METHODS = {"sendDocument", "sendMediaGroup", "sendPhoto", "sendVoice"}
+
+
+class FakeBotAPI(BaseRequest):
+    """
+    Answers Bot API calls locally after `latency` seconds (`upload_latency` for file uploads).
+    A `flood_rate` share of calls is refused with a one-second flood wait, as Telegram does.
+    """
+
+    def __init__(self, latency=0.05, upload_latency=0.3, flood_rate=0.0, seed=0):
+        self.latency = latency
+        self.upload_latency = upload_latency
+        self.flood_rate = flood_rate
+        self.rnd = random.Random(seed)
+        self.calls = Counter()
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, chat_id, **extra):
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id or 0), "type": "private"},
+            **extra,
+        }
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        await asyncio.sleep(self.upload_latency if endpoint in UPLOAD_METHODS else self.latency)
+
+        if endpoint != "getMe" and self.rnd.random() < self.flood_rate:
+            self.calls["429"] += 1
+            return 429, json.dumps({
+                "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            }).encode("utf-8")
+
+        params = request_data.parameters if request_data else {}
+        chat_id = params.get("chat_id")
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Load", "username": "loadtest_bot"}
+        elif endpoint == "sendDocument":
+            file_id = f"doc-{self._message_id}"
+            result = self._message(chat_id, document={"file_id": file_id, "file_unique_id": file_id})
+        elif endpoint == "sendMediaGroup":
+            media = params.get("media") or []
+            result = [
+                self._message(chat_id, document={"file_id": f"doc-{self._message_id}-{i}", "file_unique_id": f"u{i}"})
+                for i in range(len(media))
+            ]
+        elif endpoint == "sendVoice":
+            result = self._message(chat_id, voice={"file_id": "voice", "file_unique_id": "voice", "duration": 1})
+        elif endpoint == "getUpdates":
+            result = []
+        elif endpoint in ("sendMessage", "editMessageText"):
+            result = self._message(chat_id, text=params.get("text", ""))
+        else:
+            # answerCallbackQuery, deleteMessage, sendChatAction, setWebhook, ...
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+# --- DRIVE STAND-IN ---
+
+class _Call:
+    def __init__(self, latency, result):
+        self.latency = latency
+        self.result = result
+
+    def execute(self, **kwargs):
+        time.sleep(self.latency)
+        return self.result
+
+
+class _MediaHttp:
+    """Serves Range requests from memory, the way MediaIoBaseDownload fetches chunks"""
+
+    def __init__(self, content, latency):
+        self.content = content
+        self.latency = latency
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        time.sleep(self.latency)
+        start, end = map(int, headers["range"].split("=", 1)[1].split("-"))
+        chunk = self.content[start:end + 1]
+        response = httplib2.Response({
+            "status": "206",
+            "content-range": f"bytes {start}-{start + len(chunk) - 1}/{len(self.content)}",
+        })
+        return response, chunk
+
+
+class FakeDrive:
+    """files().get / files().get_media over one local workbook"""
+
+    def __init__(self, path, latency=0.1):
+        with open(path, "rb") as f:
+            self.content = f.read()
+        self.md5 = hashlib.md5(self.content).hexdigest()
+        self.latency = latency
+
+    def files(self):
+        return self
+
+    def get(self, fileId, fields=None):
+        return _Call(self.latency, {"md5Checksum": self.md5, "modifiedTime": "2025-12-31T00:00:00Z"})
+
+    def get_media(self, fileId):
+        return HttpRequest(_MediaHttp(self.content, self.latency), None,
+                           f"https://drive.invalid/{fileId}?alt=media", headers={})
+
+
+# --- LLM / SESSION STAND-INS ---
+
+class FakeSessionService:
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self._sessions = {}
+
+    async def list_sessions(self, app_name, user_id):
+        await asyncio.sleep(self.latency)
+        session = self._sessions.get(user_id)
+        return SimpleNamespace(sessions=[session] if session else [])
+
+    async def create_session(self, app_name, user_id):
+        await asyncio.sleep(self.latency)
+        session = self._sessions[user_id] = SimpleNamespace(id=f"session-{user_id}")
+        return session
+
+
+class _FinalEvent:
+    def __init__(self, text):
+        self.content = SimpleNamespace(parts=[SimpleNamespace(text=text)])
+
+    def is_final_response(self):
+        return True
+
+
+class FakeRunner:
+    """Answers every chat turn with canned text after `latency` seconds"""
+
+    def __init__(self, latency=1.0):
+        self.latency = latency
+
+    async def run_async(self, user_id, session_id, new_message):
+        await asyncio.sleep(self.latency)
+        yield _FinalEvent(f"Load test answer for {user_id}")
+
+
+# --- SYNTHETIC UPDATES ---
+
+class UpdateFactory:
+    """Telegram update payloads from a pool of allowed users, one private chat each"""
+
+    def __init__(self, days, users, seed=0):
+        self.days = days
+        self.users = [FIRST_USER_ID + i for i in range(users)]
+        self.rnd = random.Random(seed)
+        self.next_id = 1
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+    def _message(self, user_id, text):
+        message = {
+            "message_id": self.next_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return message
+
+    def gen(self, user_id):
+        day = self.rnd.choice(self.days)
+        report = self.rnd.choice(["tatsin", "sitchar", "room"])
+        formats = self.rnd.choice(["e", "p", "e p"])
+        variant = self.rnd.random()
+        if variant < 0.7:
+            return f"/gen {report} {formats} {day}"
+        if variant < 0.85:
+            # Ranges are tatsin only
+            return f"/gen tatsin {formats} week {day}"
+        return f"/gen {report} {formats}"
+
+    def make(self, kind):
+        update_id = self.next_id
+        self.next_id += 1
+        user_id = self.rnd.choice(self.users)
+        if kind == "button":
+            return {
+                "update_id": update_id,
+                "callback_query": {
+                    "id": str(update_id),
+                    "from": self._user(user_id),
+                    "chat_instance": str(user_id),
+                    "data": "action_gen_today",
+                    "message": {
+                        "message_id": update_id,
+                        "date": int(time.time()),
+                        "chat": {"id": user_id, "type": "private"},
+                        "from": {"id": 1, "is_bot": True, "first_name": "Load"},
+                        "text": "📊 Report Generator",
+                    },
+                },
+            }
+        if kind == "gen":
+            return {"update_id": update_id, "message": self._message(user_id, self.gen(user_id))}
+        if kind == "start":
+            return {"update_id": update_id, "message": self._message(user_id, "/start")}
+        return {"update_id": update_id, "message": self._message(user_id, "How many patients are admitted?")}
+
+
+# --- DRIVER ---
+
+def counter_total(name):
+    return sum(value for (counter, _), value in registry.snapshot()["counters"].items() if counter == name)
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        weights[kind.strip()] = float(weight or 1)
+    unknown = set(weights) - {"gen", "button", "chat", "start"}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown update kinds: {', '.join(sorted(unknown))}")
+    return weights
+
+
+async def run_level(client, factory, mix, concurrency, total, bot_api):
+    kinds = factory.rnd.choices(list(mix), weights=list(mix.values()), k=total)
+    updates = [(kind, factory.make(kind)) for kind in kinds]
+    pending = iter(updates)
+    latencies = {kind: [] for kind in mix}
+    statuses = Counter()
+    calls_before = Counter(bot_api.calls)
+    counted = ("stage_errors_total", "agent_errors_total", "telegram_retry_after_total", "telegram_throttled_total")
+    before = {name: counter_total(name) for name in counted}
+    jobs_failed_before = registry.snapshot()["counters"].get(("jobs_total", (("result", "error"),)), 0)
+
+    async def worker():
+        for kind, update in pending:
+            start = time.perf_counter()
+            try:
+                response = await client.post("/", json=update)
+                statuses[response.status_code] += 1
+            except Exception as e:
+                statuses[type(e).__name__] += 1
+            latencies[kind].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    await main.report_queue.join()
+    drained = time.perf_counter() - start
+
+    everything = [t for values in latencies.values() for t in values]
+    failed = sum(n for status, n in statuses.items() if status != 200)
+
+    def percentiles(values):
+        if not values:
+            return None
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {"p50_ms": round(p50 * 1000, 1), "p95_ms": round(p95 * 1000, 1), "p99_ms": round(p99 * 1000, 1),
+                "max_ms": round(max(values) * 1000, 1), "count": len(values)}
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "webhook": percentiles(everything),
+        "by_kind": {kind: percentiles(values) for kind, values in latencies.items() if values},
+        "throughput_rps": round(total / elapsed, 1),
+        "drain_s": round(drained, 2),
+        "http_errors": failed,
+        "http_error_rate": round(failed / total, 4),
+        "statuses": {str(k): v for k, v in statuses.items()},
+        "stage_errors": counter_total("stage_errors_total") - before["stage_errors_total"],
+        "agent_errors": counter_total("agent_errors_total") - before["agent_errors_total"],
+        "flood_waits": counter_total("telegram_retry_after_total") - before["telegram_retry_after_total"],
+        "throttled_calls": counter_total("telegram_throttled_total") - before["telegram_throttled_total"],
+        "failed_jobs": registry.snapshot()["counters"].get(("jobs_total", (("result", "error"),)), 0) - jobs_failed_before,
+        "bot_api_calls": dict(bot_api.calls - calls_before),
+    }
+
+
+def print_level(result, out):
+    hook = result["webhook"]
+    print(f"concurrency={result['concurrency']:>4}  {result['throughput_rps']:8.1f} req/s  "
+          f"p50 {hook['p50_ms']:8.1f}  p95 {hook['p95_ms']:8.1f}  p99 {hook['p99_ms']:8.1f} ms  "
+          f"errors {result['http_error_rate']:.1%} (stage {result['stage_errors']}, agent {result['agent_errors']}, "
+          f"jobs {result['failed_jobs']})  drained in {result['drain_s']:.1f} s  "
+          f"flood waits {result['flood_waits']}, throttled {result['throttled_calls']}", file=out)
+    for kind, stats in result["by_kind"].items():
+        print(f"    {kind:6} n={stats['count']:<5} p50 {stats['p50_ms']:8.1f}  p95 {stats['p95_ms']:8.1f}  "
+              f"p99 {stats['p99_ms']:8.1f} ms", file=out)
+
+
+async def run(args, workdir, out):
+    # Workbook whose dates end today, so "today" buttons and recent /gen dates have rows
+    today = datetime.now()
+    df = benchmark.make_ward_dataframe(args.rows, end_date=today, days=30)
+    xlsx = os.path.join(workdir, "ward.xlsx")
+    df.to_excel(xlsx, index=False, engine="xlsxwriter")
+    days = [benchmark.burmese_date(today - timedelta(days=n)) for n in range(14)]
+
+    bot_api = FakeBotAPI(args.bot_latency, args.upload_latency, args.flood_rate, args.seed)
+    main.build_application = lambda build=main.build_application: build(request=bot_api)
+    main.workbook_cache.service_factory = lambda drive=FakeDrive(xlsx, args.drive_latency): drive
+    main.workbook_cache.cache_dir = os.path.join(workdir, "drive")
+    main.workbook_cache.max_age = args.drive_max_age
+    main._session_service = FakeSessionService(args.session_latency)
+    runner = FakeRunner(args.llm_latency)
+    main.get_runner = lambda: runner
+    logic.SIDECAR_DIR = os.path.join(workdir, "sidecars")
+    if args.render == "stub":
+        renderer = benchmark.StubRenderer()
+        logic.get_renderer = lambda font_path, wkhtmltopdf_path: renderer
+
+    factory = UpdateFactory(days, args.users, args.seed)
+    main.ALLOWED_USER_IDS[:] = factory.users
+
+    results = []
+    async with asynccontextmanager(main.lifespan)(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+            for concurrency in args.concurrency:
+                result = await run_level(client, factory, args.mix, concurrency, args.requests, bot_api)
+                results.append(result)
+                print_level(result, out)
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=lambda v: [int(n) for n in v.split(",")], default=[1, 8, 32],
+                        help="in-flight webhook requests per level, comma separated")
+    parser.add_argument("--requests", type=int, default=200, help="updates per level")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("gen=5,button=2,chat=3"),
+                        help="update kinds and weights: gen, button, chat, start")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=5000, help="rows in the synthetic workbook")
+    parser.add_argument("--render", choices=["stub", "configured"], default="stub",
+                        help="stub PNGs, or the renderer RENDER_BACKEND selects")
+    parser.add_argument("--bot-latency", type=float, default=0.05, help="seconds per Bot API call")
+    parser.add_argument("--upload-latency", type=float, default=0.3, help="seconds per file upload")
+    parser.add_argument("--flood-rate", type=float, default=0.0,
+                        help="share of Bot API calls refused with a RetryAfter")
+    parser.add_argument("--drive-latency", type=float, default=0.1, help="seconds per Drive call / chunk")
+    parser.add_argument("--drive-max-age", type=float, default=60, help="seconds between Drive metadata checks")
+    parser.add_argument("--session-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="seconds per agent turn")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's own logging")
+    args = parser.parse_args()
+
+    out = sys.stdout
+    with tempfile.TemporaryDirectory() as workdir:
+        logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+        with logs:
+            results = asyncio.run(run(args, workdir, out))
+
+    if args.output:
+        settings = {k: v for k, v in vars(args).items() if k not in ("output", "verbose")}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "levels": results}, f, ensure_ascii=False, indent=2)
+        print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,7 +1,15 @@
 import pandas as pd
-import imgkit
+import numpy as np
 import os
+import io
 import zipfile
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from render import get_renderer
+from metrics import span, inc, run_in_context
 
 # Burmese digits map
 burmese_digits = str.maketrans("0123456789", "၀၁၂၃၄၅၆၇၈၉")
@@ -9,194 +17,576 @@ burmese_digits = str.maketrans("0123456789", "၀၁၂၃၄၅၆၇၈၉")
 def to_burmese_number(n):
     return str(n).translate(burmese_digits)
 
-def generate_image_from_html(html_content, output_path, wkhtmltopdf_path):
-    """Helper to run imgkit with specific binary path"""
-    config = imgkit.config(wkhtmltoimage=wkhtmltopdf_path)
-    options = {
-        'format': 'png',
-        'encoding': "UTF-8",
-        'enable-local-file-access': None,
-        'quiet': ''
-    }
-    imgkit.from_string(html_content, output_path, config=config, options=options)
+# --- PARSED WORKBOOK CACHE ---
+# Parsing xlsx through openpyxl is the slowest step, so each workbook version is parsed once:
+# kept in an in-process LRU and written as a pickle sidecar that warm workers load instead.
+DF_CACHE_SIZE = int(os.getenv("DF_CACHE_SIZE", "2"))
+SIDECAR_DIR = os.getenv("DF_SIDECAR_DIR", "/tmp/df_cache")
+SIDECAR_KEEP = 3
+
+_df_cache = OrderedDict()
+_df_cache_lock = threading.Lock()
+_df_load_lock = threading.Lock()
+
+def file_checksum(path):
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _cache_get(key):
+    with _df_cache_lock:
+        df = _df_cache.get(key)
+        if df is not None:
+            _df_cache.move_to_end(key)
+        return df
+
+def _cache_put(key, df):
+    with _df_cache_lock:
+        _df_cache[key] = df
+        _df_cache.move_to_end(key)
+        while len(_df_cache) > DF_CACHE_SIZE:
+            _df_cache.popitem(last=False)
+
+def _write_sidecar(sidecar_path, df):
+    try:
+        os.makedirs(SIDECAR_DIR, exist_ok=True)
+        tmp_path = f"{sidecar_path}.{threading.get_ident()}.part"
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, sidecar_path)
+
+        sidecars = sorted(
+            (os.path.join(SIDECAR_DIR, n) for n in os.listdir(SIDECAR_DIR) if n.endswith('.pkl')),
+            key=os.path.getmtime, reverse=True
+        )
+        for old in sidecars[SIDECAR_KEEP:]:
+            os.remove(old)
+    except OSError as e:
+        # The sidecar is only an optimisation
+        print(f"Sidecar write failed: {e}")
+
+# --- COMPACT REPRESENTATION ---
+# Ranks, units, regions, rooms and diagnoses repeat across thousands of rows; as categoricals they
+# are stored once plus small integer codes. Flags the reports need per row are derived here once.
+CATEGORY_COLUMNS = ['အဆင့်', 'တော်စပ်ပုံ', 'တပ်', 'တိုင်း', 'ကွပ်ကဲမှု့', 'ဖြစ်စဥ်‌နေရာ', 'ရောဂါ(အဂ်လိပ်)', 'ရောဂါ(မြန်မာ)', 'room']
+# Columns with more distinct values than this share of rows are left as they are
+CATEGORY_MAX_RATIO = 0.5
+PATIENT_TYPE_PATTERN = r"ကြည်း|ရေ|လေ|အန်|N"
+
+def _patient_type(df):
+    """ရှိ for service members (by id prefix), ခြား for everyone else"""
+    if '_patient_type' in df.columns:
+        return df['_patient_type']
+    is_member = df["ကိုယ်ပိုင်အမှတ်"].astype('string').str.contains(PATIENT_TYPE_PATTERN, case=False, na=False)
+    return is_member.map({True: "ရှိ", False: "ခြား"}).astype(pd.CategoricalDtype(["ရှိ", "ခြား"]))
+
+def compact_dataframe(df):
+    """Converts repeated text columns to categoricals and adds the derived _patient_type/_is_dead columns, in place"""
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype) and df[col].nunique() <= CATEGORY_MAX_RATIO * len(df):
+            df[col] = df[col].astype('category')
+    if '_patient_type' not in df.columns:
+        df['_patient_type'] = _patient_type(df)
+    if '_is_dead' not in df.columns:
+        df['_is_dead'] = _is_dead(df)
+    return df
+
+def load_dataframe(input_file_path):
+    """
+    Returns the parsed workbook, parsing the xlsx only once per content hash.
+    The returned DataFrame is shared between requests, treat it as read-only.
+    """
+    key = file_checksum(input_file_path)
+    df = _cache_get(key)
+    if df is not None:
+        inc("cache_requests_total", cache="dataframe", result="memory")
+        return df
+
+    with _df_load_lock:
+        # Another thread may have parsed it while we waited
+        df = _cache_get(key)
+        if df is not None:
+            inc("cache_requests_total", cache="dataframe", result="memory")
+            return df
+
+        sidecar_path = os.path.join(SIDECAR_DIR, f"{key}.pkl")
+        df = None
+        if os.path.exists(sidecar_path):
+            try:
+                with span("workbook.sidecar_load"):
+                    df = pd.read_pickle(sidecar_path)
+            except Exception as e:
+                print(f"Sidecar load failed, parsing xlsx: {e}")
+        if df is None:
+            inc("cache_requests_total", cache="dataframe", result="parse")
+            with span("workbook.parse"):
+                df = compact_dataframe(pd.read_excel(input_file_path))
+            _write_sidecar(sidecar_path, df)
+        else:
+            inc("cache_requests_total", cache="dataframe", result="sidecar")
+            # Sidecars written before the compact representation
+            compact_dataframe(df)
+
+        _mark_loaded(df, key)
+        _cache_put(key, df)
+        return df
+
+# --- PER-VERSION DERIVED DATA ---
+# Values computed from a loaded workbook (parsed dates, indexes, ...) are cached next to it,
+# keyed by the content hash load_dataframe stores in df.attrs.
+# Entries are Futures: the first caller builds the value, concurrent callers for the same key wait for it.
+_derived_cache = OrderedDict()
+_derived_lock = threading.Lock()
+# version -> the frame load_dataframe returned for it, for as long as anyone holds that frame
+_loaded_frames = weakref.WeakValueDictionary()
+
+def _mark_loaded(df, version):
+    df.attrs['workbook_version'] = version
+    _loaded_frames[version] = df
+
+def _is_loaded(df):
+    """True for the frame load_dataframe returned; slices and copies inherit attrs but are not it"""
+    version = df.attrs.get('workbook_version')
+    return version is not None and _loaded_frames.get(version) is df
+
+def _derived(df, name, builder):
+    if not _is_loaded(df):
+        return builder(df)
+    key = (df.attrs['workbook_version'], name)
+    with _derived_lock:
+        future = _derived_cache.get(key)
+        owner = future is None
+        if owner:
+            future = _derived_cache[key] = Future()
+            while len(_derived_cache) > DF_CACHE_SIZE * 16:
+                _derived_cache.popitem(last=False)
+        else:
+            _derived_cache.move_to_end(key)
+
+    if not owner:
+        # Another thread may still be building it (e.g. sitchar and room of one "Generate All")
+        inc("cache_requests_total", cache=f"derived.{name}", result="hit" if future.done() else "wait")
+        return future.result()
+
+    inc("cache_requests_total", cache=f"derived.{name}", result="miss")
+    try:
+        with span(f"derived.{name}"):
+            value = builder(df)
+    except BaseException as e:
+        # Waiters get the error; the next caller tries again
+        with _derived_lock:
+            if _derived_cache.get(key) is future:
+                del _derived_cache[key]
+        future.set_exception(e)
+        raise
+    future.set_result(value)
+    return value
+
+# --- DATE MATCHING ---
+ascii_digits = str.maketrans("၀၁၂၃၄၅၆၇၈၉", "0123456789")
+DATE_COLUMNS = ['ဆေးရုံတက်ရက်', 'ဆေးရုံဆင်းရက်', 'ဆေးရုံပြောင်းရက်']
+# D-M-YY or D-M-YYYY not glued to other digits ("exp" notes around it are fine)
+DATE_PATTERN = r"(?<!\d)(\d{1,2})-(\d{1,2})-(\d{4}|\d{2})(?!\d)"
+
+def parse_date_column(series):
+    """Converts D-M-YYYY texts (Burmese or ASCII digits) to datetime64; anything else becomes NaT"""
+    # Dates repeat a lot, so only the distinct values are parsed
+    codes, uniques = pd.factorize(series)
+    text = pd.Series(uniques, dtype=object).astype(str).str.translate(ascii_digits)
+    parts = text.str.extract(DATE_PATTERN).apply(pd.to_numeric)
+    parts.columns = ['day', 'month', 'year']
+    parts['year'] = parts['year'].where(parts['year'] >= 100, parts['year'] + 2000)
+    parsed = pd.to_datetime(parts[['year', 'month', 'day']], errors='coerce')
+
+    values = np.append(parsed.to_numpy(), np.datetime64('NaT'))
+    # factorize marks missing values with -1, which picks the trailing NaT
+    return pd.Series(values[codes], index=series.index, name=series.name)
+
+def parse_date(text):
+    parsed = parse_date_column(pd.Series([text]))[0]
+    return None if pd.isna(parsed) else parsed
+
+def _date_columns(df):
+    return pd.DataFrame({col: parse_date_column(df[col]) for col in DATE_COLUMNS})
+
+def _date_index(df):
+    """Maps each date to the sorted row positions where it appears in any of the date columns"""
+    dates = _derived(df, 'dates', _date_columns)
+    positions = np.tile(np.arange(len(df)), len(DATE_COLUMNS))
+    values = np.concatenate([dates[col].to_numpy() for col in DATE_COLUMNS])
+    valid = ~pd.isna(values)
+    grouped = pd.Series(positions[valid]).groupby(values[valid])
+    return {date: np.unique(rows.to_numpy()) for date, rows in grouped}
+
+def rows_on_date(df, wanted_date_str):
+    """Rows admitted, discharged or transferred on the given date (exact date match, not a substring match)"""
+    wanted = parse_date(wanted_date_str)
+    if wanted is None:
+        return df.iloc[0:0]
+    if _is_loaded(df):
+        rows = _derived(df, 'date_index', _date_index).get(wanted)
+        return df.iloc[rows] if rows is not None else df.iloc[0:0]
+
+    dates = _date_columns(df)
+    return df[(dates == wanted).any(axis=1)]
 
 def calculate_admitted_df_len(input_file_path):
-    df = pd.read_excel(input_file_path)
+    df = load_dataframe(input_file_path)
     cols_na = ['ဆေးရုံဆင်းရက်','ဆေးရုံပြောင်းရက်']
     admitted_patients = df[df[cols_na].isna().all(axis=1)]
     return len(admitted_patients)
 
+# --- CENSUS SNAPSHOT ---
+# Counts the agent tools answer from, computed once per workbook version.
+CENSUS_STATUSES = ['admitted', 'discharged', 'transferred', 'died']
+DIAGNOSIS_GROUPS = ['EAMI', 'EASPW', 'EAGSW']
+
+def _is_dead(df):
+    # Deaths are noted as "exp"/"die" in the discharge column; the date sits in the transfer column
+    if '_is_dead' in df.columns:
+        return df['_is_dead']
+    return df["ဆေးရုံဆင်းရက်"].astype('string').str.contains(r"exp|die", case=False, na=False).astype(bool)
+
+def _patient_status(df):
+    """Current status of every row, one of CENSUS_STATUSES"""
+    dead = _is_dead(df)
+    status = np.select(
+        [dead, df['ဆေးရုံဆင်းရက်'].notna(), df['ဆေးရုံပြောင်းရက်'].notna()],
+        ['died', 'discharged', 'transferred'],
+        'admitted'
+    )
+    return pd.Series(status, index=df.index)
+
+def _diagnosis_group(df):
+    """EAMI / EASPW / EAGSW from the English diagnosis, 'other' for everything else"""
+    pattern = '(' + '|'.join(DIAGNOSIS_GROUPS) + ')'
+    group = df['ရောဂါ(အဂ်လိပ်)'].astype('string').str.upper().str.extract(pattern, expand=False)
+    return group.fillna('other').astype(object)
+
+def _count_table(keys, status):
+    counts = pd.crosstab(keys, status).reindex(columns=CENSUS_STATUSES, fill_value=0)
+    return {str(key): {col: int(n) for col, n in row.items()} for key, row in counts.iterrows()}
+
+def _build_census(df):
+    status = _patient_status(df)
+    census = {
+        'totals': {col: int((status == col).sum()) for col in CENSUS_STATUSES},
+        'by_unit': _count_table(df['တပ်'].astype(object).fillna('-'), status),
+        'by_diagnosis': _count_table(_diagnosis_group(df), status),
+        'by_room': _count_table(df['room'].astype(object).fillna('-'), status) if 'room' in df.columns else {},
+    }
+
+    # Per day: admissions, discharges, transfers and deaths that happened on that date
+    dates = _derived(df, 'dates', _date_columns)
+    dead = _is_dead(df)
+    events = {
+        'admitted': dates['ဆေးရုံတက်ရက်'],
+        'discharged': dates['ဆေးရုံဆင်းရက်'][~dead],
+        'transferred': dates['ဆေးရုံပြောင်းရက်'][~dead],
+        'died': dates['ဆေးရုံပြောင်းရက်'][dead],
+    }
+    per_day = pd.DataFrame({col: days.value_counts() for col, days in events.items()})
+    per_day = per_day.reindex(columns=CENSUS_STATUSES).fillna(0).astype(int)
+    census['by_date'] = {day: {col: int(n) for col, n in row.items()} for day, row in per_day.iterrows()}
+    return census
+
+def census_snapshot(df):
+    """
+    {'totals', 'by_unit', 'by_room', 'by_diagnosis': counts per current status,
+     'by_date': {Timestamp: events on that day}} for a loaded workbook.
+    Shared between callers, treat it as read-only.
+    """
+    return _derived(df, 'census', _build_census)
+
+def load_census(input_file_path):
+    return census_snapshot(load_dataframe(input_file_path))
+
+# --- ADMITTED PATIENT AGGREGATES ---
+# sitchar and room both pivot currently admitted patients by unit. The admitted rows are encoded
+# once per workbook version into (group, room, unit) counts and both pivots are cut from that small table.
+OPERATION_PATTERN = r'EAMI|EASPW|EAGSW'
+AGG_KEYS = ['group', 'room', 'unit']
+AGG_COLUMNS = ['ကိုယ်ပိုင်အမှတ်', 'ဆေးရုံဆင်းရက်', 'ဆေးရုံပြောင်းရက်', 'ရောဂါ(အဂ်လိပ်)', 'တပ်', 'room']
+
+def _with_missing(labels, codes):
+    # codes are shifted by one so that 0 stands for a missing value
+    return np.concatenate([[np.nan], np.asarray(labels, dtype=object)])[codes]
+
+def _count_admitted(df):
+    """Counts of currently admitted patients (rows with an id) per (group, room, unit); a missing room or unit stays NaN"""
+    admitted = (df['ဆေးရုံဆင်းရက်'].isna() & df['ဆေးရုံပြောင်းရက်'].isna() & df['ကိုယ်ပိုင်အမှတ်'].notna()).to_numpy()
+    n = int(admitted.sum())
+
+    # The diagnosis pattern runs once per distinct diagnosis, not once per row
+    diag_codes, diagnoses = pd.factorize(df['ရောဂါ(အဂ်လိပ်)'].to_numpy()[admitted])
+    is_operation = pd.Series(diagnoses, dtype=object).astype(str).str.contains(OPERATION_PATTERN, case=False).to_numpy()
+    group_codes = np.append(is_operation, False)[diag_codes].astype(np.int64)
+    groups = np.array(['အခြား', 'စဆရ'], dtype=object)
+
+    # sort=True keeps the label order pd.pivot_table would produce
+    unit_codes, units = pd.factorize(df['တပ်'].to_numpy()[admitted], sort=True)
+    if 'room' in df.columns:
+        room_codes, rooms = pd.factorize(df['room'].to_numpy()[admitted], sort=True)
+    else:
+        room_codes, rooms = np.full(n, -1), []
+
+    sizes = (len(groups), len(rooms) + 1, len(units) + 1)
+    flat = np.ravel_multi_index((group_codes, room_codes + 1, unit_codes + 1), sizes)
+    counts = np.bincount(flat, minlength=int(np.prod(sizes)))
+    present = np.flatnonzero(counts)
+    g, r, u = np.unravel_index(present, sizes)
+    return pd.DataFrame({
+        'group': groups[g],
+        'room': _with_missing(rooms, r),
+        'unit': _with_missing(units, u),
+        'n': counts[present],
+    })
+
+def _merge_counts(*tables):
+    merged = pd.concat(tables, ignore_index=True).groupby(AGG_KEYS, dropna=False, sort=False)['n'].sum()
+    return merged.reset_index()
+
+# Aggregates of the most recently seen version; a new version that only appends rows extends them
+_last_aggregate = None
+_last_aggregate_lock = threading.Lock()
+
+def _is_prefix(old, new):
+    cols = [c for c in AGG_COLUMNS if c in old.columns]
+    if list(old.columns) != list(new.columns) or len(old) >= len(new):
+        return False
+    head = new.iloc[:len(old)].reset_index(drop=True)
+    for c in cols:
+        if old[c].dtype == head[c].dtype:
+            same = old[c].reset_index(drop=True).equals(head[c])
+        else:
+            # A new version may have gained categories; compare the values
+            same = pd.Series(old[c].to_numpy(dtype=object)).equals(pd.Series(head[c].to_numpy(dtype=object)))
+        if not same:
+            return False
+    return True
+
+def _admitted_aggregate(df):
+    global _last_aggregate
+    with _last_aggregate_lock:
+        last = _last_aggregate
+    if last is not None and last[0] is not df and _is_prefix(last[0], df):
+        counts = _merge_counts(last[1], _count_admitted(df.iloc[len(last[0]):]))
+    else:
+        counts = _count_admitted(df)
+    if _is_loaded(df):
+        with _last_aggregate_lock:
+            _last_aggregate = (df, counts)
+    return counts
+
+def admitted_counts(df):
+    """(group, room, unit, n) counts of currently admitted patients, computed once per workbook version"""
+    return _derived(df, 'admitted_counts', _admitted_aggregate)
+
+def admitted_pivot(counts, by):
+    """Pivot of admitted counts, `by` ('group' or 'room') x unit, with ပေါင်း totals; same layout as pd.pivot_table"""
+    pivot = counts.groupby([by, 'unit'])['n'].sum().unstack('unit', fill_value=0)
+    pivot.loc['ပေါင်း'] = pivot.sum()
+    pivot['ပေါင်း'] = pivot.sum(axis=1)
+    pivot.index.name = None
+    pivot.columns.name = None
+    return pivot
+
+def _blank(series):
+    """Column values as an object array with missing values shown as ''"""
+    values = series.to_numpy(dtype=object)
+    return np.where(pd.isna(values), '', values)
+
 def build_custom_table(df):
-    df = df.reset_index(drop=True)
-    result = pd.DataFrame()
-
-    result["စဉ်"] = [to_burmese_number(i+1) for i in range(len(df))]
-    result["ကိုယ်ပိုင်အမှတ်"] = df['ကိုယ်ပိုင်အမှတ်']
-    result["အဆင့်"] = df["အဆင့်"]
-
-    pattern = r"ကြည်း|ရေ|လေ|အန်|N"
-    result["လူနာအမျိုး အစား"] = df["ကိုယ်ပိုင်အမှတ်"].str.contains(pattern, case=False, na=False).map({True: "ရှိ", False: "ခြား"})
-
-    result["အမည်"] = df["အမည်"]
-    result["တော်စပ်ပုံ"] = df["တော်စပ်ပုံ"]
-    result["မှီခို အမည်"] = df["မှီခိုအမည်"]
-    result["အသက်"] = df["အသက်"]
-    result["စစ်သက်"] = df["စစ်သက်"]
-    result["တပ်"] = df["တပ်"]
-    result["တိုင်း"] = df["တိုင်း"]
-    result["ကွပ်ကဲမှု"] = df["ကွပ်ကဲမှု့"] 
-    result["ဖြစ်စဉ်နေရာ"] = df["ဖြစ်စဥ်‌နေရာ"]
-    result["ဖြစ်စဉ်ရက်စွဲ"] = df["ဖြစ်စဉ်ရက်စွဲ"]
-    result["ရောဂါ(အဂ်လိပ်)"] = df["ရောဂါ(အဂ်လိပ်)"]
-    result["ရောဂါ(မြန်မာ)"] = df["ရောဂါ(မြန်မာ)"]
-    result["တက်ရောက် သည့်ဆေးရုံ"] = "မဆခွဲ ၂/၅"
-    result["ဆေးရုံတက် ရက်စွဲ"] = df["ဆေးရုံတက်ရက်"]
-
-    is_dead = df["ဆေးရုံဆင်းရက်"].str.contains(r"exp|die", case=False, na=False)
-    result["ဆေးရုံဆင်း ရက်စွဲ"] = df["ဆေးရုံဆင်းရက်"].where(~is_dead, "")
-    result["ဆေးရုံပြောင်း ရက်စွဲ"] = df["ဆေးရုံပြောင်းရက်"].where(~is_dead, "")
-    result["သေဆုံး ရက်စွဲ"] = df["ဆေးရုံပြောင်းရက်"].where(is_dead, "")
-    result["မှတ်ချက်"] = df["မှတ်ချက်"]
-
-    return result.fillna('')
+    """
+    The tatsin table for the given rows. Columns are assembled as arrays into one new frame,
+    without copying or re-indexing the source rows first.
+    """
+    is_dead = _is_dead(df).to_numpy()
+    discharged = _blank(df["ဆေးရုံဆင်းရက်"])
+    transferred = _blank(df["ဆေးရုံပြောင်းရက်"])
+
+    columns = {
+        "စဉ်": [to_burmese_number(i+1) for i in range(len(df))],
+        "ကိုယ်ပိုင်အမှတ်": _blank(df['ကိုယ်ပိုင်အမှတ်']),
+        "အဆင့်": _blank(df["အဆင့်"]),
+        "လူနာအမျိုး အစား": _blank(_patient_type(df)),
+        "အမည်": _blank(df["အမည်"]),
+        "တော်စပ်ပုံ": _blank(df["တော်စပ်ပုံ"]),
+        "မှီခို အမည်": _blank(df["မှီခိုအမည်"]),
+        "အသက်": _blank(df["အသက်"]),
+        "စစ်သက်": _blank(df["စစ်သက်"]),
+        "တပ်": _blank(df["တပ်"]),
+        "တိုင်း": _blank(df["တိုင်း"]),
+        "ကွပ်ကဲမှု": _blank(df["ကွပ်ကဲမှု့"]),
+        "ဖြစ်စဉ်နေရာ": _blank(df["ဖြစ်စဥ်‌နေရာ"]),
+        "ဖြစ်စဉ်ရက်စွဲ": _blank(df["ဖြစ်စဉ်ရက်စွဲ"]),
+        "ရောဂါ(အဂ်လိပ်)": _blank(df["ရောဂါ(အဂ်လိပ်)"]),
+        "ရောဂါ(မြန်မာ)": _blank(df["ရောဂါ(မြန်မာ)"]),
+        "တက်ရောက် သည့်ဆေးရုံ": "မဆခွဲ ၂/၅",
+        "ဆေးရုံတက် ရက်စွဲ": _blank(df["ဆေးရုံတက်ရက်"]),
+        "ဆေးရုံဆင်း ရက်စွဲ": np.where(is_dead, '', discharged),
+        "ဆေးရုံပြောင်း ရက်စွဲ": np.where(is_dead, '', transferred),
+        "သေဆုံး ရက်စွဲ": np.where(is_dead, transferred, ''),
+        "မှတ်ချက်": _blank(df["မှတ်ချက်"]),
+    }
+    return pd.DataFrame(columns, index=pd.RangeIndex(len(df)))
+
+# --- PARALLEL OUTPUTS ---
+# Generators run on one pool and hand their Excel/PNG writes to another,
+# so a generator waiting on its outputs never holds a slot its outputs need.
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "4"))
+_report_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="report")
+_output_pool = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="report-output")
+
+def _gather(futures):
+    """Waits for all futures, then returns their results in submission order (raising the first error in that order)"""
+    wait(futures)
+    return [f.result() for f in futures]
+
+def _write_outputs(outputs):
+    """Runs (file_name, producer) pairs concurrently and returns (file_name, bytes) pairs in order"""
+    contents = _gather([run_in_context(_output_pool, producer) for _, producer in outputs])
+    return [(name, data) for (name, _), data in zip(outputs, contents)]
+
+# --- IN-MEMORY OUTPUTS ---
+# Reports are produced as bytes and sent straight to Telegram; nothing is written to /tmp (RAM on Cloud Run).
+
+def _excel_bytes(frame, index=True):
+    buf = io.BytesIO()
+    # in_memory keeps xlsxwriter from staging the sheet in temp files
+    with span("output.excel"), pd.ExcelWriter(buf, engine='xlsxwriter', engine_kwargs={'options': {'in_memory': True}}) as writer:
+        frame.to_excel(writer, index=index)
+    return buf.getvalue()
+
+def _png_bytes(renderer, frame, title, index=True):
+    buf = io.BytesIO()
+    with span("output.png"):
+        renderer.render_table(frame, title, buf, index=index)
+    return buf.getvalue()
 
 # --- MODULAR GENERATORS ---
 
-def _gen_tatsin(df, output_folder, wanted_date_str, font_css, wkhtmltopdf_path, formats=['e', 'p']):
-    files = []
+def _gen_tatsin(df, wanted_date_str, renderer, formats=['e', 'p']):
+    outputs = []
     # Filter for Tatsin
-    cols_check = ['ဆေးရုံတက်ရက်', 'ဆေးရုံဆင်းရက်', 'ဆေးရုံပြောင်းရက်']
-    df_bydate = df[df[cols_check].astype(str).apply(lambda row: row.str.contains(wanted_date_str, na=False)).any(axis=1)]
+    df_bydate = rows_on_date(df, wanted_date_str)
 
     if df_bydate.empty:
         return []
 
-    table_df = build_custom_table(df_bydate)
+    with span("table.build"):
+        table_df = build_custom_table(df_bydate)
 
     if 'e' in formats:
         excel_name = f"tatsin_{wanted_date_str}.xlsx"
-        table_df.to_excel(os.path.join(output_folder, excel_name), index=False)
-        files.append(excel_name)
+        outputs.append((excel_name, lambda: _excel_bytes(table_df, index=False)))
 
     if 'p' in formats:
-        html = f"<html><head><meta charset='utf-8'>{font_css}</head><body><h3>ဆေးရုံ တက်/ဆင်း/ပြောင်း {wanted_date_str}</h3>{table_df.to_html(index=False, border=0)}</body></html>"
         img_name = f"tatsin_{wanted_date_str}.png"
-        generate_image_from_html(html, os.path.join(output_folder, img_name), wkhtmltopdf_path)
-        files.append(img_name)
+        outputs.append((img_name, lambda: _png_bytes(renderer, table_df, f"ဆေးရုံ တက်/ဆင်း/ပြောင်း {wanted_date_str}", index=False)))
     
-    return files
+    return _write_outputs(outputs)
 
-def _gen_sitchar(df, output_folder, wanted_date_str, font_css, wkhtmltopdf_path, formats=['e', 'p']):
-    files = []
-    cols_na = ['ဆေးရုံဆင်းရက်','ဆေးရုံပြောင်းရက်']
-    admitted_patients = df[df[cols_na].isna().all(axis=1)]
+def _gen_sitchar(df, wanted_date_str, renderer, formats=['e', 'p']):
+    outputs = []
+    counts = admitted_counts(df)
+    counts = counts[counts['unit'].notna()]
 
-    if admitted_patients.empty:
+    if counts.empty:
         return []
 
-    pattern = r'EAMI|EASPW|EAGSW'
-    admitted_patients = admitted_patients.copy()
-    admitted_patients['group'] = admitted_patients['ရောဂါ(အဂ်လိပ်)'].str.contains(pattern, case=False, na=False).map({True: 'စဆရ', False: 'အခြား'})
-
-    pivot = pd.pivot_table(admitted_patients, index='group', columns='တပ်', values='ကိုယ်ပိုင်အမှတ်', aggfunc='count', fill_value=0)
-    pivot.loc['ပေါင်း'] = pivot.sum()
-    pivot['ပေါင်း'] = pivot.sum(axis=1)
-    pivot.index.name = None
-    pivot.columns.name = None
+    pivot = admitted_pivot(counts, 'group')
 
     if 'e' in formats:
         excel_name = f"sitchar_{wanted_date_str}.xlsx"
-        pivot.to_excel(os.path.join(output_folder, excel_name))
-        files.append(excel_name)
+        outputs.append((excel_name, lambda: _excel_bytes(pivot)))
 
     if 'p' in formats:
-        html = f"<html><head><meta charset='utf-8'>{font_css}</head><body><h3>စစ်ဆင်ရေးဒဏ်ရာနှင့် အခြားရောဂါ အခြေပြဇယား {wanted_date_str}</h3>{pivot.to_html(border=0)}</body></html>"
         img_name = f"sitchar_{wanted_date_str}.png"
-        generate_image_from_html(html, os.path.join(output_folder, img_name), wkhtmltopdf_path)
-        files.append(img_name)
+        outputs.append((img_name, lambda: _png_bytes(renderer, pivot, f"စစ်ဆင်ရေးဒဏ်ရာနှင့် အခြားရောဂါ အခြေပြဇယား {wanted_date_str}")))
     
-    return files
+    return _write_outputs(outputs)
 
-def _gen_room(df, output_folder, wanted_date_str, font_css, wkhtmltopdf_path, formats=['e', 'p']):
-    files = []
-    cols_na = ['ဆေးရုံဆင်းရက်','ဆေးရုံပြောင်းရက်']
-    admitted_patients = df[df[cols_na].isna().all(axis=1)]
+def _gen_room(df, wanted_date_str, renderer, formats=['e', 'p']):
+    outputs = []
+    if 'room' not in df.columns:
+        return []
+
+    counts = admitted_counts(df)
+    counts = counts[counts['room'].notna() & counts['unit'].notna()]
 
-    if admitted_patients.empty or 'room' not in admitted_patients.columns:
+    if counts.empty:
         return []
 
-    pivot_room = pd.pivot_table(admitted_patients, index='room', columns='တပ်', values='ကိုယ်ပိုင်အမှတ်', aggfunc='count', fill_value=0)
-    pivot_room.loc['ပေါင်း'] = pivot_room.sum()
-    pivot_room['ပေါင်း'] = pivot_room.sum(axis=1)
-    pivot_room.index.name = None
-    pivot_room.columns.name = None
+    pivot_room = admitted_pivot(counts, 'room')
 
     if 'e' in formats:
         excel_name = f"room_{wanted_date_str}.xlsx"
-        pivot_room.to_excel(os.path.join(output_folder, excel_name))
-        files.append(excel_name)
+        outputs.append((excel_name, lambda: _excel_bytes(pivot_room)))
 
     if 'p' in formats:
-        html = f"<html><head><meta charset='utf-8'>{font_css}</head><body><h3>ဆေးရုံတက်နေရာ အခြေပြဇယား {wanted_date_str}</h3>{pivot_room.to_html(border=0)}</body></html>"
         img_name = f"room_{wanted_date_str}.png"
-        generate_image_from_html(html, os.path.join(output_folder, img_name), wkhtmltopdf_path)
-        files.append(img_name)
+        outputs.append((img_name, lambda: _png_bytes(renderer, pivot_room, f"ဆေးရုံတက်နေရာ အခြေပြဇယား {wanted_date_str}")))
     
-    return files
+    return _write_outputs(outputs)
 
 # --- MAIN FUNCTIONS ---
 
-def process_data(input_file_path, output_folder, wanted_date_str, font_path, wkhtmltopdf_path):
+GENERATORS = {'tatsin': _gen_tatsin, 'sitchar': _gen_sitchar, 'room': _gen_room}
+# sitchar and room count the patients admitted right now; only tatsin depends on the date
+DATED_REPORTS = ['tatsin']
+
+def _generate(report_type, *args):
+    with span(f"report.{report_type}"):
+        return GENERATORS[report_type](*args)
+
+def process_data(input_file_path, wanted_date_str, font_path, wkhtmltopdf_path):
     """
     Original function for the 'Generate All' button. 
-    It simply calls all 3 specific generators with defaults.
+    It runs all 3 specific generators concurrently with defaults;
+    returns (file_name, bytes) pairs, always in tatsin, sitchar, room order.
     """
-    df = pd.read_excel(input_file_path)
+    df = load_dataframe(input_file_path)
     
-    font_css = f"""
-    <style>
-        @font-face {{
-          font-family: 'NotoSansMyanmar';
-          src: url('file://{font_path}') format('truetype');
-        }}
-        body {{ font-family: 'NotoSansMyanmar', sans-serif; }}
-        table {{ border-collapse: collapse; font-size: 15px; width: 100%; }}
-        th, td {{ border: 1px solid #444; padding: 4px 8px; text-align: center; }}
-        th {{ background: #f2f2f2; }}
-    </style>
-    """
+    renderer = get_renderer(font_path, wkhtmltopdf_path)
+    
+    results = _gather([run_in_context(_report_pool, _generate, name, df, wanted_date_str, renderer) for name in GENERATORS])
     
     all_files = []
-    all_files.extend(_gen_tatsin(df, output_folder, wanted_date_str, font_css, wkhtmltopdf_path))
-    all_files.extend(_gen_sitchar(df, output_folder, wanted_date_str, font_css, wkhtmltopdf_path))
-    all_files.extend(_gen_room(df, output_folder, wanted_date_str, font_css, wkhtmltopdf_path))
+    for files in results:
+        all_files.extend(files)
     
     return all_files
 
-def process_specific_report(input_file_path, output_folder, wanted_date_str, font_path, wkhtmltopdf_path, report_type, formats):
+def process_specific_report(input_file_path, wanted_date_str, font_path, wkhtmltopdf_path, report_type, formats):
     """
     New function for /gen commands.
     """
-    df = pd.read_excel(input_file_path)
+    df = load_dataframe(input_file_path)
     
-    font_css = f"""
-    <style>
-        @font-face {{
-          font-family: 'NotoSansMyanmar';
-          src: url('file://{font_path}') format('truetype');
-        }}
-        body {{ font-family: 'NotoSansMyanmar', sans-serif; }}
-        table {{ border-collapse: collapse; font-size: 15px; width: 100%; }}
-        th, td {{ border: 1px solid #444; padding: 4px 8px; text-align: center; }}
-        th {{ background: #f2f2f2; }}
-    </style>
-    """
+    renderer = get_renderer(font_path, wkhtmltopdf_path)
     
-    if report_type == 'tatsin':
-        return _gen_tatsin(df, output_folder, wanted_date_str, font_css, wkhtmltopdf_path, formats)
-    elif report_type == 'sitchar':
-        return _gen_sitchar(df, output_folder, wanted_date_str, font_css, wkhtmltopdf_path, formats)
-    elif report_type == 'room':
-        return _gen_room(df, output_folder, wanted_date_str, font_css, wkhtmltopdf_path, formats)
+    if report_type in GENERATORS:
+        return _generate(report_type, df, wanted_date_str, renderer, formats)
     
     return []
+
+def process_date_range(input_file_path, wanted_date_strs, font_path, wkhtmltopdf_path, report_type, formats):
+    """
+    Batch version of process_specific_report for several days.
+    The workbook is loaded and indexed once; days are generated concurrently, files come back in day order.
+    Only DATED_REPORTS can be generated per day; other types give no files.
+    """
+    if report_type not in DATED_REPORTS:
+        return []
+
+    df = load_dataframe(input_file_path)
+    renderer = get_renderer(font_path, wkhtmltopdf_path)
+
+    results = _gather([run_in_context(_report_pool, _generate, report_type, df, day, renderer, formats) for day in wanted_date_strs])
+
+    all_files = []
+    for files in results:
+        all_files.extend(files)
+    return all_files
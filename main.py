@@ -1,14 +1,21 @@
 import os
 import uvicorn
 import asyncio
+import io
 import zipfile
-import shutil
+import tempfile
+import threading
+import time
 import traceback
-import google.auth
 import re  # Added for date regex
+import sys
+import hashlib
+import subprocess
 from datetime import datetime, timedelta
 from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -19,24 +26,21 @@ from telegram.ext import (
     MessageHandler,
     filters
 )
-from googleapiclient.discovery import build
 
-# --- IMPORT GOOGLE GENAI AND WAVE FOR TTS AGENT ---
+# --- IMPORT WAVE FOR TTS AGENT ---
 import wave
-from google import genai
-
-# --- IMPORT GOOGLE ADK components ---
-from google import adk
-from google.adk.agents import Agent, LlmAgent
-from google.adk.models.google_llm import Gemini
-from google.adk.runners import InMemoryRunner
-from google.adk.tools import google_search, AgentTool
-from google.genai import types
-from google.adk.sessions import VertexAiSessionService
-from google.genai.errors import ClientError
 
 # --- IMPORT LOGIC ---
-from logic import process_data, process_specific_report, calculate_admitted_df_len
+# google-genai, google-adk and logic (pandas) take seconds to import, so they are
+# imported where first used; warm_up() loads them in the background after startup.
+from drive import workbook_cache
+from render import get_renderer
+from jobs import JobQueue
+from idempotency import UpdateDeduplicator
+from artifacts import ArtifactCache
+from delivery import TelegramRateLimiter, Throttled, BEST_EFFORT, send_documents
+from updates import ChatOrderedUpdateProcessor
+from metrics import registry, span, inc, request_log
 
 # 1. Load Secrets
 TOKEN = os.getenv("TELEGRAM_TOKEN")
@@ -46,6 +50,11 @@ GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
 PROJECT_ID = os.getenv("PROJECT_ID")
 LOCATION = os.getenv("LOCATION")    
 AGENT_ENGINE_ID = os.getenv("AGENT_ENGINE_ID")
+# vertex (default), memory or sqlite — the local backends are for development and tests
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "vertex")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "/tmp/sessions.db")
+# Seconds a user's session id is reused without asking the session service
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "3600"))
 app_name = "assistant-ai-tg"
 
 ALLOWED_USER_IDS = []
@@ -57,78 +66,194 @@ if ADMIN_ENV:
 
 # --- CONFIGURATION ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_FOLDER = '/tmp/uploads'
 FONT_PATH = os.path.join(BASE_DIR, 'fonts', 'NotoSansMyanmar-Regular.ttf')
 WKHTML_PATH = '/usr/bin/wkhtmltoimage'
+MAX_RANGE_DAYS = 62
+VOICE_CACHE_DIR = '/tmp/voice_cache'
+VOICE_CACHE_MAX_FILES = int(os.getenv("VOICE_CACHE_MAX_FILES", "200"))
+TTS_VOICE = 'Kore'
+# Report jobs generated at once; the rest wait in the queue
+REPORT_QUEUE_WORKERS = int(os.getenv("REPORT_QUEUE_WORKERS", "2"))
+# Agent conversations allowed to run at once on this instance
+AGENT_CONCURRENCY = int(os.getenv("AGENT_CONCURRENCY", "8"))
+# Updates handled at once; one chat's updates still run in order
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+# Of those, report commands and agent chats may each take at most this many
+REPORT_UPDATE_CONCURRENCY = int(os.getenv("REPORT_UPDATE_CONCURRENCY", "8"))
+CHAT_UPDATE_CONCURRENCY = int(os.getenv("CHAT_UPDATE_CONCURRENCY", str(AGENT_CONCURRENCY)))
+# Pre-load the renderer, workbook and agent tree in the background once the server is up
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1") == "1"
+# Seconds to wait before warming up, so uvicorn binds the port and answers the startup probe first
+STARTUP_WARMUP_DELAY = float(os.getenv("STARTUP_WARMUP_DELAY", "1"))
 
 
-# --- CONFIGURE RETRY OPTIONS ---
-retry_config=types.HttpRetryOptions(
-    attempts=5,  # Maximum retry attempts
-    exp_base=7,  # Delay multiplier
-    initial_delay=1, # Initial delay before first retry (in seconds)
-    http_status_codes=[429, 500, 503, 504] # Retry on these HTTP errors
-)
-
 # old id > '1yRy9ozaiFIgarkBRKrE5tGXEoMs2BSDa'
 TARGET_FILE_ID = '1st92Nn51HGInuTlQ_u-sfMPJBIvTBlIO'
 
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
 # --- generate audio and returns the filename ---
-def generate_voice_response(text_to_speak: str) -> str:
+async def generate_voice_response(text_to_speak: str) -> str:
     """
     Converts text into a cheerful audio voice file. 
     Use this when the user specifically asks for a voice response or to 'speak'.
     """
-    client = genai.Client() # Uses GEMINI_API_KEY from environment
-    
-    response = client.models.generate_content(
-        model="gemini-2.5-flash-preview-tts",
-        contents=f"Say cheerfully: {text_to_speak}",
-        config=types.GenerateContentConfig(
-            response_modalities=["AUDIO"],
-            speech_config=types.SpeechConfig(
-                voice_config=types.VoiceConfig(
-                    prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name='Kore')
-                )
-            ),
+    # The agent runs on the event loop; keep the blocking TTS call off it
+    return await asyncio.to_thread(generate_voice_sync, text_to_speak)
+
+_genai_client = None
+_genai_client_lock = threading.Lock()
+
+def get_genai_client():
+    global _genai_client
+    with _genai_client_lock:
+        if _genai_client is None:
+            from google import genai
+            _genai_client = genai.Client() # Uses GEMINI_API_KEY from environment
+        return _genai_client
+
+def encode_voice(pcm_data, output_path):
+    """
+    Encodes 24 kHz mono PCM as OGG/Opus (what Telegram voice notes expect, ~10x smaller than WAV).
+    Falls back to WAV when ffmpeg is not installed; returns the path actually written.
+    """
+    try:
+        subprocess.run(
+            ['ffmpeg', '-loglevel', 'error', '-y', '-f', 's16le', '-ar', '24000', '-ac', '1', '-i', 'pipe:0',
+             '-c:a', 'libopus', '-b:a', '32k', '-f', 'ogg', output_path],
+            input=pcm_data, check=True
         )
+        return output_path
+    except FileNotFoundError:
+        wav_path = os.path.splitext(output_path)[0] + '.wav'
+        with wave.open(wav_path, "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(24000)
+            wf.writeframes(pcm_data)
+        return wav_path
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        # Pruned by a concurrent request; sorts as oldest
+        return 0
+
+def prune_voice_cache():
+    clips = sorted(
+        (os.path.join(VOICE_CACHE_DIR, n) for n in os.listdir(VOICE_CACHE_DIR) if not n.startswith('tmp')),
+        key=_mtime, reverse=True
     )
+    for old in clips[VOICE_CACHE_MAX_FILES:]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+
+def generate_voice_sync(text_to_speak, voice_name=TTS_VOICE):
+    """Returns a clip for (text, voice); identical requests reuse the cached clip"""
+    os.makedirs(VOICE_CACHE_DIR, exist_ok=True)
+    key = hashlib.sha256(f"{voice_name}\0{text_to_speak}".encode('utf-8')).hexdigest()
+    for ext in ('.ogg', '.wav'):
+        cached_path = os.path.join(VOICE_CACHE_DIR, key + ext)
+        try:
+            os.utime(cached_path) # keep recently used clips
+        except FileNotFoundError:
+            # Not cached, or pruned by a concurrent request since
+            continue
+        inc("cache_requests_total", cache="voice", result="hit")
+        return cached_path
+
+    inc("cache_requests_total", cache="voice", result="miss")
+    from google.genai import types
+    client = get_genai_client()
+    
+    with span("tts.generate"):
+        response = client.models.generate_content(
+            model="gemini-2.5-flash-preview-tts",
+            contents=f"Say cheerfully: {text_to_speak}",
+            config=types.GenerateContentConfig(
+                response_modalities=["AUDIO"],
+                speech_config=types.SpeechConfig(
+                    voice_config=types.VoiceConfig(
+                        prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name=voice_name)
+                    )
+                ),
+            )
+        )
     
     audio_data = response.candidates[0].content.parts[0].inline_data.data
-    file_path = "/tmp/response_voice.wav" # Using /tmp for Cloud Run compatibility
     
-    with wave.open(file_path, "wb") as wf:
-        wf.setnchannels(1)
-        wf.setsampwidth(2)
-        wf.setframerate(24000)
-        wf.writeframes(audio_data)
-        
+    # Each request encodes into its own temp file, then publishes it under the cache key
+    fd, tmp_path = tempfile.mkstemp(prefix='tmp', suffix='.ogg', dir=VOICE_CACHE_DIR)
+    os.close(fd)
+    try:
+        with span("tts.encode"):
+            written_path = encode_voice(audio_data, tmp_path)
+        file_path = os.path.join(VOICE_CACHE_DIR, key + os.path.splitext(written_path)[1])
+        os.replace(written_path, file_path)
+    finally:
+        for leftover in (tmp_path, os.path.splitext(tmp_path)[0] + '.wav'):
+            try:
+                os.remove(leftover)
+            except FileNotFoundError:
+                pass
+    
+    prune_voice_cache()
     return file_path
 
 # --- SECURE DRIVE DOWNLOADER ---
-def download_file_from_drive(output_path):
-    SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
-    creds, _ = google.auth.default(scopes=SCOPES)
-    service = build('drive', 'v3', credentials=creds)
-    
-    request = service.files().get_media(fileId=TARGET_FILE_ID)
-    with open(output_path, 'wb') as f:
-        f.write(request.execute())
+def download_file_from_drive():
+    """Returns the local path of the latest workbook (downloaded only when Drive has a new version)"""
+    return workbook_cache.get(TARGET_FILE_ID).path
 
-def get_admitted_patients_count() -> str:
+# --- CENSUS TOOLS ---
+# Agent data questions are answered from a census snapshot computed once per workbook version,
+# so a warm question costs a dictionary lookup instead of a download and parse.
+_census = {}
+
+def get_census():
+    workbook = workbook_cache.get(TARGET_FILE_ID)
+    census = _census.get(workbook.version)
+    inc("cache_requests_total", cache="census", result="hit" if census is not None else "miss")
+    if census is None:
+        from logic import load_census
+        census = load_census(workbook.path)
+        _census.clear()
+        _census[workbook.version] = census
+    return census
+
+def census_tool_sync(answer):
+    """Runs answer(census) and wraps its dict in the tools' OK/ERROR envelope"""
+    try:
+        with span("agent.tool"):
+            return {**answer(get_census()), "status": "OK"}
+    except Exception as e:
+        return {"error": str(e), "status": "ERROR"}
+
+def lookup_counts(table, name, label):
+    """All rows of a census table, or the one whose name matches (ignoring case and spaces)"""
+    if not name or not name.strip():
+        return {label: table}
+    wanted = name.strip().lower()
+    for key, counts in table.items():
+        if key.strip().lower() == wanted:
+            return {label: {key: counts}}
+    raise ValueError(f"No {label.rstrip('s')} named '{name}'. Known: {', '.join(sorted(table))}")
+
+async def get_admitted_patients_count() -> dict:
     """
     Calculates and returns the total number of currently admitted patients.
 
     This function don't need any argument.
 
-    This function reads the local data, and returns the total admitted patients count in a dictionary.
+    This function reads the local data, and returns the total admitted patients count in a dictionary,
+    along with the totals of discharged, transferred and died patients.
 
     Returns:
         dict: a dictionary of either one of these examples
               {
                   "admitted_patients_count": count:int,
+                  "totals": {"admitted": int, "discharged": int, "transferred": int, "died": int},
                   "status": "OK",
               }
                or
@@ -138,29 +263,70 @@ def get_admitted_patients_count() -> str:
                   "status": "ERROR",
               }
     """
-    if os.path.exists(UPLOAD_FOLDER):
-        shutil.rmtree(UPLOAD_FOLDER)
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    
-    excel_path = os.path.join(UPLOAD_FOLDER, "drive_data.xlsx")
-    download_file_from_drive(excel_path)
+    # The first question after a new workbook version downloads and parses it; keep that off the event loop
+    return await asyncio.to_thread(census_tool_sync, lambda census: {
+        "admitted_patients_count": census["totals"]["admitted"],
+        "totals": census["totals"],
+    })
 
-    if not os.path.exists(excel_path):
-        return "Error: Data file not found. Please ask user to 'Fix loading data file properly' first to download the latest data."
+async def get_patient_counts_by_unit(unit: str) -> dict:
+    """
+    Returns admitted, discharged, transferred and died patient counts per unit (တပ်).
 
-    try:
-        count = calculate_admitted_df_len(excel_path)
-        output = {
-            "admitted_patients_count": count,
-            "status": "OK",
-        }
-        return output
-    except Exception as e:
-        output = {
-            "error": str(e),
-            "status": "ERROR",
-        }
-        return output
+    Args:
+        unit: the unit name, e.g. "ခလရ 12". Pass an empty string to get every unit.
+
+    Returns:
+        dict: {"units": {unit: {"admitted": int, "discharged": int, "transferred": int, "died": int}}, "status": "OK"}
+              or {"error": "error string", "status": "ERROR"}
+    """
+    return await asyncio.to_thread(census_tool_sync, lambda census: lookup_counts(census["by_unit"], unit, "units"))
+
+async def get_patient_counts_by_room(room: str) -> dict:
+    """
+    Returns admitted, discharged, transferred and died patient counts per hospital room.
+
+    Args:
+        room: the room name. Pass an empty string to get every room.
+
+    Returns:
+        dict: {"rooms": {room: {"admitted": int, "discharged": int, "transferred": int, "died": int}}, "status": "OK"}
+              or {"error": "error string", "status": "ERROR"}
+    """
+    return await asyncio.to_thread(census_tool_sync, lambda census: lookup_counts(census["by_room"], room, "rooms"))
+
+async def get_patient_counts_by_diagnosis_group() -> dict:
+    """
+    Returns admitted, discharged, transferred and died patient counts per diagnosis group:
+    EAMI, EASPW and EAGSW (operation injuries) and "other" for every other diagnosis.
+
+    This function don't need any argument.
+
+    Returns:
+        dict: {"diagnosis_groups": {group: {"admitted": int, "discharged": int, "transferred": int, "died": int}}, "status": "OK"}
+              or {"error": "error string", "status": "ERROR"}
+    """
+    return await asyncio.to_thread(census_tool_sync, lambda census: {"diagnosis_groups": census["by_diagnosis"]})
+
+async def get_patient_movements_on_date(date: str) -> dict:
+    """
+    Returns how many patients were admitted, discharged, transferred and died on one day.
+
+    Args:
+        date: the day as D-M-YYYY, in Burmese or English digits, e.g. "၆-၁၂-၂၀၂၅" or "6-12-2025".
+
+    Returns:
+        dict: {"date": date, "admitted": int, "discharged": int, "transferred": int, "died": int, "status": "OK"}
+              or {"error": "error string", "status": "ERROR"}
+    """
+    def answer(census):
+        from logic import parse_date, CENSUS_STATUSES
+        day = parse_date(date)
+        if day is None:
+            raise ValueError(f"'{date}' is not a D-M-YYYY date")
+        counts = census["by_date"].get(day, dict.fromkeys(CENSUS_STATUSES, 0))
+        return {"date": date, **counts}
+    return await asyncio.to_thread(census_tool_sync, answer)
 
 # runner = InMemoryRunner(agent = root_agent)
 
@@ -179,6 +345,25 @@ def get_burmese_yesterday():
     yesterday = datetime.now() - timedelta(days=1)
     return convert_to_burmese_date(yesterday)
 
+def parse_command_date(text):
+    # Regex for date: 1-2 digits, hyphen, 1-2 digits, hyphen, 2 or 4 digits
+    # Matches: 4-12-25, 04-12-2025
+    date_match = re.match(r"^(\d{1,2})-(\d{1,2})-(\d{2,4})$", text)
+    if not date_match:
+        return None
+    try:
+        d, m, y = map(int, date_match.groups())
+        # Handle 2-digit year (e.g., 25 -> 2025)
+        if y < 100:
+            y += 2000
+        return datetime(y, m, d)
+    except ValueError:
+        # Invalid date numbers (e.g. month 13)
+        return None
+
+def date_span(start, end):
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
 # --- KEYBOARDS ---
 def get_main_menu_keyboard():
     keyboard = [
@@ -202,44 +387,123 @@ async def enforce_access(update: Update, context: ContextTypes.DEFAULT_TYPE):
         raise ApplicationHandlerStop
 
 # --- HEAVY TASKS (SYNC) ---
-def generate_reports_sync(date_string):
+# Files are built in memory as (file_name, bytes) and uploaded straight from the buffers.
+def generate_reports_sync(excel_path, date_string):
     """Old button logic: generates ALL files and Zips them"""
-    if os.path.exists(UPLOAD_FOLDER):
-        shutil.rmtree(UPLOAD_FOLDER)
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    
-    excel_path = os.path.join(UPLOAD_FOLDER, "drive_data.xlsx")
-    download_file_from_drive(excel_path)
+    from logic import process_data
+    generated_files = process_data(excel_path, date_string, FONT_PATH, WKHTML_PATH)
     
-    generated_files = process_data(excel_path, UPLOAD_FOLDER, date_string, FONT_PATH, WKHTML_PATH)
-    
-    zip_filename = f"Report_{date_string}.zip"
-    zip_path = os.path.join(UPLOAD_FOLDER, zip_filename)
+    return [zip_files(generated_files, f"Report_{date_string}.zip")] # Return as list to match structure
+
+def zip_files(files, zip_filename):
+    buf = io.BytesIO()
     
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
-        for f in generated_files:
-            file_path = os.path.join(UPLOAD_FOLDER, f)
-            if os.path.exists(file_path):
-                zipf.write(file_path, arcname=f)
+    # PNGs barely shrink, but the xlsx members and the zip directory do
+    with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_DEFLATED) as zipf:
+        for name, data in files:
+            zipf.writestr(name, data)
                 
-    return [zip_path] # Return as list to match structure
+    return zip_filename, buf.getvalue()
 
-def generate_specific_sync(date_string, r_type, r_formats):
+def generate_specific_sync(excel_path, date_string, r_type, r_formats):
     """New command logic: generates specific files"""
-    if os.path.exists(UPLOAD_FOLDER):
-        shutil.rmtree(UPLOAD_FOLDER)
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    
-    excel_path = os.path.join(UPLOAD_FOLDER, "drive_data.xlsx")
-    download_file_from_drive(excel_path)
-    
-    # Call the new specific logic
-    generated_files = process_specific_report(
-        excel_path, UPLOAD_FOLDER, date_string, FONT_PATH, WKHTML_PATH, r_type, r_formats
+    from logic import process_specific_report
+    return process_specific_report(
+        excel_path, date_string, FONT_PATH, WKHTML_PATH, r_type, r_formats
+    )
+
+def generate_range_sync(excel_path, date_strings, r_type, r_formats):
+    """Batch command logic: one download/parse for all days, sent back as a single zip"""
+    from logic import process_date_range
+    generated_files = process_date_range(
+        excel_path, date_strings, FONT_PATH, WKHTML_PATH, r_type, r_formats
     )
+    if not generated_files:
+        return []
     
-    # Return full paths
-    return [os.path.join(UPLOAD_FOLDER, f) for f in generated_files]
+    return [zip_files(generated_files, f"{r_type}_{date_strings[0]}_{date_strings[-1]}.zip")]
+
+# --- REPORT JOB QUEUE ---
+# Report commands are queued so the webhook answers Telegram right away;
+# identical requests in flight share one job.
+report_queue = JobQueue(REPORT_QUEUE_WORKERS)
+# Finished reports per workbook version; repeated requests skip rendering and, via file_id, the upload
+artifact_cache = ArtifactCache()
+
+class ReportRequest:
+    """A chat waiting for a report job: its status message shows progress, then it receives the files"""
+
+    def __init__(self, bot, chat_id, status_message, header, caption=None, follow_up=False):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.status_message = status_message
+        self.header = header
+        self.caption = caption
+        self.follow_up = follow_up
+
+    async def progress(self, text):
+        try:
+            # Progress is dropped rather than delaying the files when the chat is at its rate limit
+            await self.bot.edit_message_text(
+                f"{self.header}\n<i>{text}</i>", chat_id=self.chat_id,
+                message_id=self.status_message.message_id, parse_mode='HTML', rate_limit_args=BEST_EFFORT
+            )
+        except (BadRequest, Throttled, RetryAfter) as e:
+            # "Message is not modified", a busy chat and similar are harmless here
+            print(f"Progress edit skipped: {e}")
+
+    async def deliver(self, artifacts, empty_text):
+        if not artifacts:
+            await self.status_message.edit_text(empty_text)
+            return
+
+        # One album per ten files; resent by file_id when Telegram already has them
+        await send_documents(self.bot, self.chat_id, artifacts, caption=self.caption)
+
+        if self.follow_up:
+            await self.bot.send_message(self.chat_id, "Done! What else?", reply_markup=get_main_menu_keyboard())
+        else:
+            await self.status_message.delete() # cleanup "processing" message
+
+    async def fail(self, exc):
+        await self.status_message.edit_text(f"❌ Error occurred processing command.\n{str(exc)[:300]}")
+
+def report_job(generate_sync, args, empty_text):
+    """
+    Builds the queued work: reuse the cached result for this workbook version or
+    generate it in memory, then deliver to every subscriber.
+    """
+    async def work(job):
+        with request_log("report_job", key=job.key), span("report.job"):
+            await job.progress("Checking workbook version...")
+            with span("report.workbook"):
+                workbook = await asyncio.to_thread(workbook_cache.get, TARGET_FILE_ID)
+            cache_key = (workbook.version,) + job.key
+
+            artifacts = artifact_cache.get(cache_key)
+            inc("cache_requests_total", cache="artifacts", result="hit" if artifacts is not None else "miss")
+            if artifacts is None:
+                await job.progress("Generating files...")
+                with span("report.generate"):
+                    outputs = await asyncio.to_thread(generate_sync, workbook.path, *args)
+                artifacts = artifact_cache.put(cache_key, outputs)
+            if artifacts:
+                await job.progress("Uploading...")
+
+            async def deliver(subscriber):
+                try:
+                    with span("report.deliver"):
+                        await subscriber.deliver(artifacts, empty_text)
+                except Exception as e:
+                    print(f"🔥 DELIVERY ERROR:\n{traceback.format_exc()}")
+                    await subscriber.fail(e)
+
+            # The first chat uploads the bytes; everyone else then gets the file_ids at once
+            subscribers = job.close()
+            if subscribers:
+                await deliver(subscribers[0])
+                await asyncio.gather(*(deliver(s) for s in subscribers[1:]))
+    return work
 
 # --- HANDLERS ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -252,6 +516,10 @@ async def gen_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     /gen tatsin e 4-12-25  -> Specific Date
     /gen tatsin p          -> Today
     /gen sitchar e p       -> Today, multiple formats
+    /gen tatsin e 1-12-25..7-12-25 -> Every day in the range, one zip
+    /gen tatsin e week     -> Last 7 days (ending today or the given date)
+    /gen tatsin e month    -> From the 1st of the month to today (or the given date)
+    Ranges are tatsin only: sitchar and room are snapshots of the current census.
     """
     args = context.args
     
@@ -259,32 +527,38 @@ async def gen_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     valid_types = ['tatsin', 'sitchar', 'room']
     valid_formats = ['e', 'p']
     
+    valid_spans = ['week', 'month']
+    # sitchar and room are snapshots of the current census; a range would repeat the same table
+    range_types = ['tatsin']
+    
     req_type = None
     req_formats = []
     custom_date_obj = None
-
-    # Regex for date: 1-2 digits, hyphen, 1-2 digits, hyphen, 2 or 4 digits
-    # Matches: 4-12-25, 04-12-2025
-    date_pattern = re.compile(r"^(\d{1,2})-(\d{1,2})-(\d{2,4})$")
+    range_dates = None
+    req_span = None
 
     # --- 1. Parse Arguments ---
     for arg in args:
         arg_lower = arg.lower()
 
         # Check for Date Pattern (e.g., 6-12-25)
-        date_match = date_pattern.match(arg)
-        if date_match:
-            try:
-                d, m, y = map(int, date_match.groups())
-                # Handle 2-digit year (e.g., 25 -> 2025)
-                if y < 100:
-                    y += 2000
-                
-                custom_date_obj = datetime(y, m, d)
-                continue # Arg processed, move to next
-            except ValueError:
-                # Invalid date numbers (e.g. month 13), ignore or let it fail later
-                pass
+        parsed_date = parse_command_date(arg)
+        if parsed_date:
+            custom_date_obj = parsed_date
+            continue # Arg processed, move to next
+
+        # Check for Date Range (e.g., 1-12-25..7-12-25)
+        if '..' in arg:
+            start_text, _, end_text = arg.partition('..')
+            start_date, end_date = parse_command_date(start_text), parse_command_date(end_text)
+            if start_date and end_date:
+                range_dates = (start_date, end_date)
+                continue
+
+        # Check for Range Shorthand
+        if arg_lower in valid_spans:
+            req_span = arg_lower
+            continue
 
         # Check for Report Type
         if arg_lower in valid_types:
@@ -307,6 +581,26 @@ async def gen_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # --- 3. Determine Date ---
+    if range_dates or req_span:
+        if req_type not in range_types:
+            await update.message.reply_text(f"⚠️ <b>Error:</b> {req_type} shows the patients admitted right now, so it has no date range. Use it without a range, or use tatsin.\nEx: <code>/gen tatsin e week</code>", parse_mode='HTML')
+            return
+        if range_dates:
+            start_date, end_date = range_dates
+        else:
+            end_date = custom_date_obj or datetime.now()
+            if req_span == 'week':
+                start_date = end_date - timedelta(days=6)
+            else:
+                start_date = end_date.replace(day=1)
+
+        days = date_span(start_date, end_date)
+        if not days or len(days) > MAX_RANGE_DAYS:
+            await update.message.reply_text(f"⚠️ <b>Error:</b> Date range must run forward and cover at most {MAX_RANGE_DAYS} days.", parse_mode='HTML')
+            return
+        await gen_range(update, context, [convert_to_burmese_date(d) for d in days], req_type, req_formats)
+        return
+
     if custom_date_obj:
         # Convert custom date to Burmese string
         target_burmese_date = convert_to_burmese_date(custom_date_obj)
@@ -317,36 +611,32 @@ async def gen_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         display_info = "Today"
 
     # --- 4. Execution ---
-    msg = await update.message.reply_text(
+    header = (
         f"⏳ <b>Processing...</b>\n"
         f"Type: {req_type.upper()} [{', '.join(req_formats).upper()}]\n"
-        f"Date: {target_burmese_date} ({display_info})", 
-        parse_mode='HTML'
+        f"Date: {target_burmese_date} ({display_info})"
     )
+    msg = await update.message.reply_text(header, parse_mode='HTML')
     
-    try:
-        # Run specific generation in thread
-        file_paths = await asyncio.to_thread(
-            generate_specific_sync, target_burmese_date, req_type, req_formats
-        )
-        
-        if not file_paths:
-            await msg.edit_text(f"⚠️ No data found for {target_burmese_date}.")
-            return
+    await report_queue.submit(
+        ('specific', req_type, target_burmese_date, tuple(sorted(req_formats))),
+        report_job(generate_specific_sync, (target_burmese_date, req_type, req_formats), f"⚠️ No data found for {target_burmese_date}."),
+        ReportRequest(context.bot, update.effective_chat.id, msg, header)
+    )
 
-        # Upload files
-        for fpath in file_paths:
-            await context.bot.send_document(
-                chat_id=update.effective_chat.id,
-                document=fpath,
-                filename=os.path.basename(fpath)
-            )
-        
-        await msg.delete() # cleanup "processing" message
-        
-    except Exception as e:
-        print(f"🔥 GEN CMD ERROR:\n{traceback.format_exc()}")
-        await msg.edit_text("❌ Error occurred processing command.")
+async def gen_range(update: Update, context: ContextTypes.DEFAULT_TYPE, target_dates, req_type, req_formats):
+    header = (
+        f"⏳ <b>Processing...</b>\n"
+        f"Type: {req_type.upper()} [{', '.join(req_formats).upper()}]\n"
+        f"Dates: {target_dates[0]} → {target_dates[-1]} ({len(target_dates)} days)"
+    )
+    msg = await update.message.reply_text(header, parse_mode='HTML')
+    
+    await report_queue.submit(
+        ('range', req_type, target_dates[0], target_dates[-1], tuple(sorted(req_formats))),
+        report_job(generate_range_sync, (target_dates, req_type, req_formats), f"⚠️ No data found for {target_dates[0]} → {target_dates[-1]}."),
+        ReportRequest(context.bot, update.effective_chat.id, msg, header)
+    )
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -366,28 +656,21 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             target_date = get_burmese_yesterday()
             label = "Yesterday"
         
+        header = f"⏳ <b>Generating for {label} ({target_date})...</b>"
         await query.edit_message_text(
-            f"⏳ <b>Generating for {label} ({target_date})...</b>\n<i>Authenticating securely & Processing...</i>", 
+            f"{header}\n<i>Authenticating securely & Processing...</i>", 
             parse_mode='HTML'
         )
         
-        try:
-            # Note: generate_reports_sync returns a list containing the zip path
-            result_list = await asyncio.to_thread(generate_reports_sync, target_date)
-            zip_path = result_list[0]
-            
-            await context.bot.send_document(
-                chat_id=update.effective_chat.id,
-                document=zip_path,
-                filename=os.path.basename(zip_path),
-                caption=f"✅ Reports for {target_date} generated!"
+        # Note: generate_reports_sync returns a list containing the zip path
+        await report_queue.submit(
+            ('all', target_date),
+            report_job(generate_reports_sync, (target_date,), f"⚠️ No data found for {target_date}."),
+            ReportRequest(
+                context.bot, update.effective_chat.id, query.message, header,
+                caption=f"✅ Reports for {target_date} generated!", follow_up=True
             )
-            await query.message.reply_text("Done! What else?", reply_markup=get_main_menu_keyboard())
-            
-        except Exception as e:
-            error_details = traceback.format_exc()
-            print(f"🔥 ERROR:\n{error_details}") 
-            await query.message.reply_text(f"❌ Error Occurred:\n{str(e)[:300]}")
+        )
 
 async def send_long_message(update: Update, text: str):
     """
@@ -400,165 +683,392 @@ async def send_long_message(update: Update, text: str):
     # Safety margin: 4000 chars allows for some overhead
     MAX_LENGTH = 4000 
     
-    # Loop through the text and send chunks
+    # Loop through the text and send chunks; they must arrive in order, and the bot's
+    # rate limiter spaces them out and retries a flood wait
     for i in range(0, len(text), MAX_LENGTH):
         chunk = text[i:i + MAX_LENGTH]
         await update.message.reply_text(chunk)
             
 
-async def gemini_res(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Gemini response the user message."""
-    user_id = str(update.effective_user.id)
-    user_text = update.message.text
-    session_id = None
-    try:
-        # --- RUNNER SETUP WITH SESSIONS ---
-        # Initialize the connection to Vertex AI Session Service
-        session_service = VertexAiSessionService(
-            PROJECT_ID,
-            LOCATION,
-            AGENT_ENGINE_ID
-        )
+# --- AGENT SETUP (built once per process) ---
+_session_service = None
+_runner = None
+_agent_lock = threading.Lock()
+_agent_slots = asyncio.Semaphore(AGENT_CONCURRENCY)
+
+def get_session_service():
+    """Session service shared by all chats (Vertex AI unless SESSION_BACKEND picks a local one)"""
+    global _session_service
+    with _agent_lock:
+        if _session_service is None:
+            from google.adk.sessions import VertexAiSessionService, InMemorySessionService, DatabaseSessionService
+            if SESSION_BACKEND == "memory":
+                _session_service = InMemorySessionService()
+            elif SESSION_BACKEND == "sqlite":
+                _session_service = DatabaseSessionService(db_url=f"sqlite:///{SESSION_DB_PATH}")
+            else:
+                _session_service = VertexAiSessionService(
+                    PROJECT_ID,
+                    LOCATION,
+                    AGENT_ENGINE_ID
+                )
+        return _session_service
+
+# --- SESSION ID CACHE ---
+# user_id -> (session_id, expires_at); a warm chat turn makes no session lookup call
+_session_ids = {}
+_session_id_locks = {}
+
+def invalidate_session_id(user_id):
+    _session_ids.pop(user_id, None)
+
+async def get_session_id(user_id):
+    """Returns the user's most recent session id, creating a session when there is none"""
+    cached = _session_ids.get(user_id)
+    if cached and cached[1] > time.monotonic():
+        inc("cache_requests_total", cache="session_id", result="hit")
+        return cached[0]
+
+    inc("cache_requests_total", cache="session_id", result="miss")
+    # One lookup per user at a time, so concurrent messages don't create duplicate sessions
+    lock = _session_id_locks.setdefault(user_id, asyncio.Lock())
+    async with lock:
+        cached = _session_ids.get(user_id)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+
+        session_service = get_session_service()
 
         # Check for existing sessions
-        response = await session_service.list_sessions(app_name=app_name, user_id=user_id)
+        with span("agent.session_list"):
+            response = await session_service.list_sessions(app_name=app_name, user_id=user_id)
         if response.sessions:
             # Use the most recent session
             session_id = response.sessions[0].id
             print(f"✅ Found existing session: {session_id}")
-            # await session_service.delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
         else:
             # Create a completely new session for this user
-            session = await session_service.create_session(
-                app_name=app_name,
-                user_id=user_id
-            )
+            with span("agent.session_create"):
+                session = await session_service.create_session(
+                    app_name=app_name,
+                    user_id=user_id
+                )
             session_id = session.id
             print(f"🆕 Created new session: {session_id}")
-        
-    except Exception as e:
-        print(f"Session Error: {e}")
-        await update.message.reply_text("⚠️ Error connecting to memory service.")
-        return
 
-    # Helper method to send query to the runner
-    def call_agent(query, session_id, user_id):
-        content = types.Content(role='user', parts=[types.Part(text=query)])
-        print('runner now running..')
-
-        # Specialist for Voice Generation
-        voice_worker = LlmAgent(
-            name="voice_worker",
-            model=Gemini(model="gemini-2.5-flash-lite"),
-            description="A voice synthesis specialist. Use this ONLY when the user asks to hear a response, talk, or speak.",
-            tools=[generate_voice_response],
-            instruction="Use the generate_voice_response tool to convert your intended message into audio."
-        )
+        _session_ids[user_id] = (session_id, time.monotonic() + SESSION_CACHE_TTL)
+        return session_id
 
-        # "Worker" Agent just for Google Search
-        search_worker = LlmAgent(
-            name="search_worker",
-            model=Gemini(model="gemini-2.5-flash-lite", retry_options=retry_config),
-            tools=[google_search], 
-            instruction="You are a research specialist. Use Google Search to find current information."
-        )
+def build_root_agent():
+    from google.adk.agents import LlmAgent
+    from google.adk.models.google_llm import Gemini
+    from google.adk.tools import google_search
+    from google.genai import types
 
-        # "Worker" Agent just for Patient Data
-        data_worker = LlmAgent(
-            name="data_worker",
-            model=Gemini(model="gemini-2.5-flash-lite", retry_options=retry_config),
-            tools=[get_admitted_patients_count],
-            instruction="You are a data analyst. Use the get_admitted_patients_count to check the database."
-        )
+    # --- CONFIGURE RETRY OPTIONS ---
+    retry_config=types.HttpRetryOptions(
+        attempts=5,  # Maximum retry attempts
+        exp_base=7,  # Delay multiplier
+        initial_delay=1, # Initial delay before first retry (in seconds)
+        http_status_codes=[429, 500, 503, 504] # Retry on these HTTP errors
+    )
 
-        root_agent = LlmAgent(
-            name = "helpful_assistant",
-            model = Gemini(
-                model="gemini-2.5-flash-lite",
-                retry_options=retry_config
-            ),
-            description = "A personal assistant agent that can answer user's general questions as well as patients data. And can generate audio output if user want to.",
-            # instruction = "You are a helpful assistant. Use search_worker for current info or if unsure. Use data_worker for admitted patients data. If speech requests, use voice_worker",
-            # tools=[AgentTool(agent=search_worker), AgentTool(agent=data_worker), AgentTool(agent=voice_worker)],
-            sub_agents=[search_worker, data_worker, voice_worker],
-            instruction="""You are a helpful assistant. 
-            - For current info or general questions, use search_worker. 
-            - For patient/admitted data, use data_worker. 
-            - If the user wants a voice response or to 'speak', use voice_worker."""
-        )
-        runner = adk.Runner(
-            agent=root_agent,
-            app_name=app_name,
-            session_service=session_service
-        )
-        events = runner.run(
-            user_id=user_id, 
-            session_id=session_id, 
-            new_message=content)
-
-        for event in events:
-            if event.is_final_response():
-                # Strip any accidental whitespace/newlines from the LLM
-                final_text = event.content.parts[0].text.strip()
-                
-                # Check if the output contains a path to a wav file
-                if ".wav" in final_text:
-                    # Extract path if the LLM added extra text
-                    print("Agent Response Voice: ", final_text)
-                    path_match = re.search(r'(/tmp/\S+\.wav)', final_text)
-                    file_path = path_match.group(0) if path_match else final_text
-                    return {"type": "voice", "path": file_path}
-                
-                print("Agent Response: ", final_text)
-                return {"type": "text", "content": final_text}
+    # Specialist for Voice Generation
+    voice_worker = LlmAgent(
+        name="voice_worker",
+        model=Gemini(model="gemini-2.5-flash-lite"),
+        description="A voice synthesis specialist. Use this ONLY when the user asks to hear a response, talk, or speak.",
+        tools=[generate_voice_response],
+        instruction="Use the generate_voice_response tool to convert your intended message into audio."
+    )
 
-            else:
-                # Log intermediate steps but DON'T return
-                print(f"Processing step: {event}")
+    # "Worker" Agent just for Google Search
+    search_worker = LlmAgent(
+        name="search_worker",
+        model=Gemini(model="gemini-2.5-flash-lite", retry_options=retry_config),
+        tools=[google_search], 
+        instruction="You are a research specialist. Use Google Search to find current information."
+    )
+
+    # "Worker" Agent just for Patient Data
+    data_worker = LlmAgent(
+        name="data_worker",
+        model=Gemini(model="gemini-2.5-flash-lite", retry_options=retry_config),
+        tools=[
+            get_admitted_patients_count,
+            get_patient_counts_by_unit,
+            get_patient_counts_by_room,
+            get_patient_counts_by_diagnosis_group,
+            get_patient_movements_on_date,
+        ],
+        instruction="""You are a data analyst. Answer patient questions with your tools:
+        - get_admitted_patients_count for overall totals.
+        - get_patient_counts_by_unit / get_patient_counts_by_room for one unit (တပ်) or room, or all of them.
+        - get_patient_counts_by_diagnosis_group for EAMI / EASPW / EAGSW.
+        - get_patient_movements_on_date for admissions, discharges, transfers and deaths on a day."""
+    )
+
+    root_agent = LlmAgent(
+        name = "helpful_assistant",
+        model = Gemini(
+            model="gemini-2.5-flash-lite",
+            retry_options=retry_config
+        ),
+        description = "A personal assistant agent that can answer user's general questions as well as patients data. And can generate audio output if user want to.",
+        # instruction = "You are a helpful assistant. Use search_worker for current info or if unsure. Use data_worker for admitted patients data. If speech requests, use voice_worker",
+        # tools=[AgentTool(agent=search_worker), AgentTool(agent=data_worker), AgentTool(agent=voice_worker)],
+        sub_agents=[search_worker, data_worker, voice_worker],
+        instruction="""You are a helpful assistant. 
+        - For current info or general questions, use search_worker. 
+        - For patient/admitted data, use data_worker. 
+        - If the user wants a voice response or to 'speak', use voice_worker."""
+    )
+    return root_agent
 
-        return {"type": "text", "content": "I'm sorry, I couldn't process that request."}
+def get_runner():
+    """The agent tree and Runner are stateless per chat; only user/session ids vary per call"""
+    global _runner
+    session_service = get_session_service()
+    with _agent_lock:
+        if _runner is None:
+            from google.adk.runners import Runner
+            _runner = Runner(
+                agent=build_root_agent(),
+                app_name=app_name,
+                session_service=session_service
+            )
+        return _runner
+
+# Helper method to send query to the runner
+async def call_agent(query, session_id, user_id):
+    """
+    Runs one conversation turn on the async runner so other updates keep flowing.
+    At most AGENT_CONCURRENCY turns run at once; returns as soon as the final event arrives.
+    """
+    from google.genai import types
+    content = types.Content(role='user', parts=[types.Part(text=query)])
+
+    async with _agent_slots:
+        with span("agent.turn"):
+            print('runner now running..')
+            events = get_runner().run_async(
+                user_id=user_id, 
+                session_id=session_id, 
+                new_message=content)
+
+            try:
+                async for event in events:
+                    if event.is_final_response():
+                        # Strip any accidental whitespace/newlines from the LLM
+                        final_text = event.content.parts[0].text.strip()
+                    
+                        # Check if the output contains a path to a voice clip
+                        if ".ogg" in final_text or ".wav" in final_text:
+                            # Extract path if the LLM added extra text
+                            print("Agent Response Voice: ", final_text)
+                            path_match = re.search(r'(/tmp/\S+\.(?:ogg|wav))', final_text)
+                            file_path = path_match.group(0) if path_match else final_text
+                            return {"type": "voice", "path": file_path}
+                    
+                        print("Agent Response: ", final_text)
+                        return {"type": "text", "content": final_text}
+
+                    else:
+                        # Log intermediate steps but DON'T return
+                        print(f"Processing step: {event}")
+            finally:
+                await events.aclose()
+
+    return {"type": "text", "content": "I'm sorry, I couldn't process that request."}
+
+async def gemini_res(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Gemini response the user message."""
+    user_id = str(update.effective_user.id)
+    user_text = update.message.text
+    session_id = None
+    try:
+        # --- RUNNER SETUP WITH SESSIONS ---
+        session_id = await get_session_id(user_id)
+    except Exception as e:
+        print(f"Session Error: {e}")
+        invalidate_session_id(user_id)
+        await update.message.reply_text("⚠️ Error connecting to memory service.")
+        return
     
     try:
-        res = call_agent(user_text, session_id, user_id)
+        try:
+            res = await call_agent(user_text, session_id, user_id)
+        except ValueError as e:
+            if "Session not found" not in str(e):
+                raise
+            # The cached session was deleted or expired server-side; look it up again once
+            print(f"Stale session {session_id}: {e}")
+            invalidate_session_id(user_id)
+            session_id = await get_session_id(user_id)
+            res = await call_agent(user_text, session_id, user_id)
+
         if res and res["type"] == "voice":
-            await context.bot.send_voice(
-                chat_id=update.effective_chat.id,
-                voice=open(res["path"], 'rb')
-            )
+            with open(res["path"], 'rb') as voice_file, span("telegram.send_voice"):
+                await context.bot.send_voice(
+                    chat_id=update.effective_chat.id,
+                    voice=voice_file
+                )
         elif res and res["type"] == "text":
             await send_long_message(update, res["content"])
         else:
             await update.message.reply_text("🤔 I'm thinking, but I have nothing to say.")
     except Exception as e:
+        inc("agent_errors_total")
         print(f"Agent Execution Error: {e}")
         traceback.print_exc()
+        invalidate_session_id(user_id)
         await update.message.reply_text("⚠️ An error occurred while processing.")
 
 # --- APP SETUP ---
-ptb_application = Application.builder().token(TOKEN).build()
-ptb_application.add_handler(TypeHandler(Update, enforce_access), group=-1)
-ptb_application.add_handler(CommandHandler("start", start))
-ptb_application.add_handler(CommandHandler("gen", gen_command)) 
-ptb_application.add_handler(CallbackQueryHandler(button_handler))
-ptb_application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, gemini_res))
+REPORT_ACTIONS = ('action_gen_today', 'action_gen_yesterday')
 
+def update_kind(update):
+    """Budget an update counts against: "report", "chat" (agent turn) or None for quick ones"""
+    if not isinstance(update, Update):
+        return None
+    if update.callback_query:
+        return "report" if update.callback_query.data in REPORT_ACTIONS else None
+    text = update.message.text if update.message else None
+    if not text:
+        return None
+    if text.startswith('/'):
+        return "report" if text.split()[0].split('@')[0] == '/gen' else None
+    return "chat"
 
-async def lifespan(app: FastAPI):
+def build_update_processor():
+    return ChatOrderedUpdateProcessor(
+        UPDATE_CONCURRENCY,
+        budgets={"report": REPORT_UPDATE_CONCURRENCY, "chat": CHAT_UPDATE_CONCURRENCY},
+        classify=update_kind
+    )
+
+def build_application(request=None):
+    # Every Bot API call is throttled per chat and globally and retried after a flood wait
+    builder = Application.builder().token(TOKEN).rate_limiter(TelegramRateLimiter())
+    # Updates run concurrently, in order within a chat, with separate budgets for reports and chat
+    builder = builder.concurrent_updates(build_update_processor())
+    if request is not None:
+        # A stand-in for the Bot API, e.g. loadtest.py's fake
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
+    application.add_handler(TypeHandler(Update, enforce_access), group=-1)
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("gen", gen_command)) 
+    application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, gemini_res))
+    return application
+
+# Built in lifespan rather than at import, so importing main stays cheap
+ptb_application = None
+
+# --- STARTUP WARM-UP ---
+def warm_workbook():
+    # Downloads and parses the workbook and builds its census snapshot
+    get_census()
+
+def warm_up():
+    """Loads what the first report and the first chat turn would otherwise pay for; failures are only logged"""
+    steps = [
+        ("renderer", get_renderer(FONT_PATH, WKHTML_PATH).warm_up),
+        ("workbook", warm_workbook),
+        ("agent", get_runner),
+    ]
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"⚠️ Warm-up {name} failed: {e}")
+            continue
+        print(f"🔥 Warm-up {name}: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+async def run_warm_up():
+    await asyncio.sleep(STARTUP_WARMUP_DELAY)
+    await asyncio.to_thread(warm_up)
+
+async def start_bot():
+    """Builds and starts the PTB application and the report queue; returns the warm-up task"""
+    global ptb_application
+    ptb_application = build_application()
+    report_queue.start()
     await ptb_application.initialize()
     await ptb_application.start()
-    yield
+    return asyncio.create_task(run_warm_up()) if STARTUP_WARMUP else None
+
+async def stop_bot(warm_task):
+    if warm_task:
+        warm_task.cancel()
     await ptb_application.stop()
+    await report_queue.stop()
     await ptb_application.shutdown()
 
+async def lifespan(app: FastAPI):
+    warm_task = await start_bot()
+    yield
+    await stop_bot(warm_task)
+
+async def run_polling():
+    """
+    Local testing without a public URL: long-polls Telegram instead of serving the webhook.
+    Polling removes the bot's webhook, so use a separate test bot token.
+    """
+    warm_task = await start_bot()
+    await ptb_application.updater.start_polling()
+    print("🤖 Polling for updates, Ctrl+C to stop")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await ptb_application.updater.stop()
+        await stop_bot(warm_task)
+
 app = FastAPI(lifespan=lifespan)
 
+# Telegram retries slow webhooks with the same update_id; run each update once
+update_dedup = UpdateDeduplicator()
+
 @app.post("/")
 async def telegram_webhook(request: Request):
     data = await request.json()
+    update_id = data.get("update_id")
+    if update_id is not None and update_dedup.is_duplicate(update_id):
+        print(f"♻️ Duplicate update {update_id} dropped")
+        return {"status": "duplicate"}
     update = Update.de_json(data, ptb_application.bot)
-    await ptb_application.process_update(update)
+    with request_log("update", update_id=update_id), span("webhook.update"):
+        # Same concurrency limits and per-chat order as updates fetched by polling
+        await ptb_application.update_processor.process_update(update, ptb_application.process_update(update))
     return {"status": "ok"}
 
+def runtime_stats():
+    stats = {**update_dedup.stats(), **artifact_cache.stats()}
+    if ptb_application is not None:
+        stats.update(ptb_application.update_processor.stats())
+    return stats
+
+@app.get("/stats")
+async def stats():
+    return runtime_stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text format: per-stage latency histograms, cache/error counters and /stats values as gauges"""
+    return PlainTextResponse(
+        registry.render(runtime_stats()),
+        media_type="text/plain; version=0.0.4"
+    )
+
 if __name__ == "__main__":
-    port = int(os.environ.get("PORT", 8080))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # python main.py --polling (or BOT_POLLING=1) runs the bot locally without the web server
+    if "--polling" in sys.argv[1:] or os.getenv("BOT_POLLING") == "1":
+        try:
+            asyncio.run(run_polling())
+        except KeyboardInterrupt:
+            pass
+    else:
+        port = int(os.environ.get("PORT", 8080))
+        uvicorn.run(app, host="0.0.0.0", port=port)
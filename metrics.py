@@ -0,0 +1,149 @@
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# --- CONFIGURATION ---
+# One JSON line per webhook update / report job with its stage timings
+METRICS_JSON_LOGS = os.getenv("METRICS_JSON_LOGS", "0") == "1"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PREFIX = "bot_"
+
+# Spans of the request being handled; asyncio tasks and to_thread calls inherit it
+_current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class Registry:
+    """
+    In-process counters and per-stage latency histograms, rendered in the Prometheus text format.
+    Recording is a perf_counter call and a dict update under a lock, cheap enough for every stage.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._stages = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            hist = self._stages.get(stage)
+            if hist is None:
+                hist = self._stages[stage] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            hist[0][bisect.bisect_left(self.buckets, seconds)] += 1
+            hist[1] += seconds
+            hist[2] += 1
+
+    @contextmanager
+    def span(self, stage):
+        """Times the block as `stage`; an exception also counts as an error of that stage"""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(stage, elapsed)
+            if error is not None:
+                self.inc("stage_errors_total", stage=stage)
+            spans = _current_request.get()
+            if spans is not None:
+                spans.append((stage, elapsed, error is not None))
+
+    def snapshot(self):
+        """Plain-dict copy of everything recorded so far, for tests and /stats"""
+        with self._lock:
+            return {
+                "counters": {(name, labels): value for (name, labels), value in self._counters.items()},
+                "stages": {stage: {"count": hist[2], "sum": hist[1]} for stage, hist in self._stages.items()},
+            }
+
+    def render(self, gauges=None):
+        """Prometheus exposition text; `gauges` adds point-in-time values such as cache sizes"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            stages = sorted((stage, (list(h[0]), h[1], h[2])) for stage, h in self._stages.items())
+
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+            lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+
+        if stages:
+            lines.append(f"# TYPE {PREFIX}stage_seconds histogram")
+        for stage, (counts, total, count) in stages:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), counts):
+                cumulative += n
+                lines.append(f"{PREFIX}stage_seconds_bucket{_labels([('stage', stage), ('le', bound)])} {cumulative}")
+            lines.append(f"{PREFIX}stage_seconds_sum{_labels([('stage', stage)])} {total}")
+            lines.append(f"{PREFIX}stage_seconds_count{_labels([('stage', stage)])} {count}")
+
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {PREFIX}{name} gauge")
+            lines.append(f"{PREFIX}{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def request_log(kind, **fields):
+    """
+    Collects the spans recorded while handling one request and, with METRICS_JSON_LOGS=1,
+    prints them as a single JSON line when the request is done.
+    """
+    spans = []
+    token = _current_request.set(spans)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current_request.reset(token)
+        if METRICS_JSON_LOGS:
+            record = {
+                "event": kind,
+                **fields,
+                "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+                "spans": [{"stage": s, "ms": round(t * 1000, 1), "error": e} for s, t, e in spans],
+            }
+            if error is not None:
+                record["error"] = repr(error)[:300]
+            print(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def run_in_context(pool, fn, *args):
+    """pool.submit that keeps the caller's request context, so worker-thread spans reach its log"""
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+# Process-wide registry
+registry = Registry()
+span = registry.span
+inc = registry.inc
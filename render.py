@@ -0,0 +1,289 @@
+import os
+import threading
+
+# --- CONFIGURATION ---
+# auto: Pillow when it can shape Myanmar text (libraqm), otherwise wkhtmltoimage
+RENDER_BACKEND = os.getenv("RENDER_BACKEND", "auto")
+# Noto Sans Myanmar has no Latin glyphs; digits, ids and English diagnoses use this font
+FALLBACK_FONT_PATH = os.getenv("RENDER_FALLBACK_FONT", "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf")
+
+def _is_myanmar(ch):
+    # Myanmar, Extended-A/B blocks and the joiners used inside Burmese words
+    return '\u1000' <= ch <= '\u109f' or '\uaa60' <= ch <= '\uaa7f' or '\ua9e0' <= ch <= '\ua9ff' or ch in '\u200c\u200d'
+
+
+class RendererUnavailable(RuntimeError):
+    """The backend cannot work on this host at all (as opposed to failing on one table)"""
+
+
+class Renderer:
+    """
+    Renders a DataFrame as a titled PNG table. Backends are long-lived and shared between jobs.
+    `output` is a file path or a writable binary file object.
+    """
+    name = "base"
+
+    def warm_up(self):
+        """
+        Imports the backend and checks that it can run here, ahead of the first request.
+        Optional: render_table does the same on first use.
+        """
+
+    def render_table(self, frame, title, output, index=True):
+        raise NotImplementedError
+
+
+class WkhtmlRenderer(Renderer):
+    """The original imgkit/wkhtmltoimage path: one subprocess per image"""
+    name = "wkhtml"
+
+    def __init__(self, font_path, wkhtmltopdf_path):
+        self.font_path = font_path
+        self.wkhtmltopdf_path = wkhtmltopdf_path
+        self._config = None
+        self.font_css = f"""
+    <style>
+        @font-face {{
+          font-family: 'NotoSansMyanmar';
+          src: url('file://{font_path}') format('truetype');
+        }}
+        body {{ font-family: 'NotoSansMyanmar', sans-serif; }}
+        table {{ border-collapse: collapse; font-size: 15px; width: 100%; }}
+        th, td {{ border: 1px solid #444; padding: 4px 8px; text-align: center; }}
+        th {{ background: #f2f2f2; }}
+    </style>
+    """
+        self.options = {
+            'format': 'png',
+            'encoding': "UTF-8",
+            'enable-local-file-access': None,
+            'quiet': ''
+        }
+
+    def warm_up(self):
+        if self._config is None:
+            import imgkit
+            self._config = imgkit.config(wkhtmltoimage=self.wkhtmltopdf_path)
+
+    def render_table(self, frame, title, output, index=True):
+        import imgkit
+        self.warm_up()
+        html = f"<html><head><meta charset='utf-8'>{self.font_css}</head><body><h3>{title}</h3>{frame.to_html(index=index, border=0)}</body></html>"
+        if isinstance(output, str):
+            imgkit.from_string(html, output, config=self._config, options=self.options)
+        else:
+            # output_path=False makes imgkit return the image bytes
+            output.write(imgkit.from_string(html, False, config=self._config, options=self.options))
+
+
+class PillowRenderer(Renderer):
+    """
+    Pure-Python table rasterizer using the bundled Noto Sans Myanmar font.
+    Runs in-process, so there is no per-image process start or font load.
+    """
+    name = "pillow"
+
+    PADDING_X = 8
+    PADDING_Y = 4
+    MARGIN = 8
+    BORDER = (68, 68, 68)
+    HEADER_BG = (242, 242, 242)
+
+    TEXT_CACHE_SIZE = 4096
+
+    def __init__(self, font_path, font_size=15, title_size=19, require_shaping=True):
+        self.font_path = font_path
+        self.font_size = font_size
+        self.title_size = title_size
+        self.require_shaping = require_shaping
+        # FreeType faces are not safe to share between threads
+        self._local = threading.local()
+
+    def _layout(self):
+        from PIL import ImageFont, features
+        if features.check('raqm'):
+            return ImageFont.Layout.RAQM
+        if self.require_shaping:
+            raise RendererUnavailable("Pillow has no libraqm support; Myanmar text cannot be shaped")
+        return ImageFont.Layout.BASIC
+
+    def _load_fonts(self, size):
+        """Returns (myanmar font, fallback font) for one size"""
+        from PIL import ImageFont
+        layout = self._layout()
+        myanmar = ImageFont.truetype(self.font_path, size, layout_engine=layout)
+        if os.path.exists(FALLBACK_FONT_PATH):
+            fallback = ImageFont.truetype(FALLBACK_FONT_PATH, size, layout_engine=layout)
+        else:
+            fallback = ImageFont.load_default(size)
+        return myanmar, fallback
+
+    def _fonts(self):
+        fonts = getattr(self._local, "fonts", None)
+        if fonts is None:
+            fonts = (self._load_fonts(self.font_size), self._load_fonts(self.title_size))
+            self._local.fonts = fonts
+            self._local.texts = {}
+        return fonts
+
+    @staticmethod
+    def _runs(text):
+        """Splits text into (is_myanmar, run) pieces; whitespace stays with the current run"""
+        runs = []
+        for ch in text:
+            kind = None if ch.isspace() else _is_myanmar(ch)
+            if runs and (kind is None or runs[-1][0] == kind):
+                runs[-1][1] += ch
+            else:
+                runs.append([bool(kind), ch])
+        return runs
+
+    def _text(self, fonts, text):
+        """
+        Returns (advance width, glyph mask) for a text. FreeType rasterizing dominates
+        the render time and dates, units and ranks repeat, so masks are cached per thread.
+        """
+        from PIL import Image, ImageDraw
+        cache = self._local.texts
+        key = (id(fonts), text)
+        hit = cache.get(key)
+        if hit is None:
+            myanmar, fallback = fonts
+            ascent, descent = myanmar.getmetrics()
+            pieces = [(myanmar if is_myanmar else fallback, run) for is_myanmar, run in self._runs(text)]
+            length = sum(font.getlength(run) for font, run in pieces)
+
+            mask = Image.new("L", (max(int(length) + 2, 1), ascent + descent), 0)
+            draw = ImageDraw.Draw(mask)
+            x = 0
+            for font, run in pieces:
+                # Different fonts share the Myanmar font's baseline
+                draw.text((x, ascent), run, font=font, fill=255, anchor="ls")
+                x += font.getlength(run)
+            if len(cache) >= self.TEXT_CACHE_SIZE:
+                cache.clear()
+            hit = cache[key] = (length, mask)
+        return hit
+
+    def warm_up(self):
+        # Fonts are per thread and loaded by the rendering threads themselves
+        self._layout()
+
+    @staticmethod
+    def _cell_text(value):
+        if value is None or (isinstance(value, float) and value != value):
+            return ""
+        return str(value)
+
+    def render_table(self, frame, title, output, index=True):
+        from PIL import Image, ImageDraw
+        font, title_font = self._fonts()
+
+        header = ([""] if index else []) + [self._cell_text(c) for c in frame.columns]
+        rows = []
+        for idx, values in zip(frame.index, frame.itertuples(index=False, name=None)):
+            row = [self._cell_text(v) for v in values]
+            rows.append(([self._cell_text(idx)] if index else []) + row)
+
+        ascent, descent = font[0].getmetrics()
+        row_height = ascent + descent + 2 * self.PADDING_Y
+        t_ascent, t_descent = title_font[0].getmetrics()
+        title_height = t_ascent + t_descent + 2 * self.PADDING_Y
+
+        widths = [self._text(font, h)[0] for h in header]
+        for row in rows:
+            for i, text in enumerate(row):
+                if text:
+                    widths[i] = max(widths[i], self._text(font, text)[0])
+        widths = [int(w) + 2 * self.PADDING_X + 1 for w in widths]
+
+        table_width = sum(widths) + 1
+        title_length, title_mask = self._text(title_font, title)
+        width = max(table_width, int(title_length)) + 2 * self.MARGIN
+        height = title_height + row_height * (len(rows) + 1) + 2 * self.MARGIN + 1
+
+        image = Image.new("RGB", (width, height), "white")
+        draw = ImageDraw.Draw(image)
+        title_box = (self.MARGIN, self.MARGIN + self.PADDING_Y)
+        image.paste((0, 0, 0), title_box + (title_box[0] + title_mask.width, title_box[1] + title_mask.height), title_mask)
+
+        top = self.MARGIN + title_height
+        draw.rectangle([self.MARGIN, top, self.MARGIN + table_width - 1, top + row_height], fill=self.HEADER_BG)
+        for r, row in enumerate([header] + rows):
+            y = top + r * row_height
+            x = self.MARGIN
+            for w, text in zip(widths, row):
+                draw.rectangle([x, y, x + w, y + row_height], outline=self.BORDER)
+                if text:
+                    length, mask = self._text(font, text)
+                    left = int(x + (w - length) / 2)
+                    upper = y + self.PADDING_Y
+                    image.paste((0, 0, 0), (left, upper, left + mask.width, upper + mask.height), mask)
+                x += w
+
+        image.save(output, format="PNG")
+
+
+class FallbackRenderer(Renderer):
+    """
+    Uses the primary backend and falls back to the secondary one if it fails.
+    If the primary turns out to be unavailable on this host (warm-up or first render),
+    the secondary is used from then on.
+    """
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = f"{primary.name}+{fallback.name}"
+
+    def _disable_primary(self, primary, error):
+        if self.primary is primary and primary is not self.fallback:
+            print(f"⚠️ {primary.name} renderer unavailable, using {self.fallback.name}: {error}")
+            self.primary = self.fallback
+            self.name = self.fallback.name
+
+    def warm_up(self):
+        primary = self.primary
+        try:
+            primary.warm_up()
+        except Exception as e:
+            self._disable_primary(primary, e)
+        self.fallback.warm_up()
+
+    def render_table(self, frame, title, output, index=True):
+        primary = self.primary
+        try:
+            primary.render_table(frame, title, output, index=index)
+        except Exception as e:
+            if primary is self.fallback:
+                raise
+            if isinstance(e, RendererUnavailable):
+                self._disable_primary(primary, e)
+            else:
+                print(f"⚠️ {primary.name} render failed, retrying with {self.fallback.name}: {e}")
+            if not isinstance(output, str):
+                # Drop anything the failed backend managed to write
+                output.seek(0)
+                output.truncate()
+            self.fallback.render_table(frame, title, output, index=index)
+
+
+_renderers = {}
+_renderers_lock = threading.Lock()
+
+def get_renderer(font_path, wkhtmltopdf_path, backend=None):
+    """Returns the process-wide renderer for this configuration, creating it on first use"""
+    backend = backend or RENDER_BACKEND
+    key = (backend, font_path, wkhtmltopdf_path)
+    with _renderers_lock:
+        renderer = _renderers.get(key)
+        if renderer is None:
+            wkhtml = WkhtmlRenderer(font_path, wkhtmltopdf_path)
+            if backend == "wkhtml":
+                renderer = wkhtml
+            elif backend == "pillow":
+                renderer = PillowRenderer(font_path)
+            else:
+                renderer = FallbackRenderer(PillowRenderer(font_path), wkhtml)
+            _renderers[key] = renderer
+        return renderer
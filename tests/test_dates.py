@@ -0,0 +1,95 @@
+import pandas as pd
+import pytest
+
+import logic
+
+
+def ward(admitted, discharged, transferred, version=None):
+    df = pd.DataFrame({
+        "ဆေးရုံတက်ရက်": admitted,
+        "ဆေးရုံဆင်းရက်": discharged,
+        "ဆေးရုံပြောင်းရက်": transferred,
+    })
+    if version is not None:
+        logic._mark_loaded(df, version)
+    return df
+
+
+# rows_on_date uses the per-version date index for a loaded workbook frame,
+# and plain parsed-date masks otherwise; both must agree
+@pytest.fixture(params=[None, "index"], ids=["mask", "index"])
+def version(request):
+    return request.param and f"{request.param}-{request.node.name}"
+
+
+def matched(df, date):
+    return logic.rows_on_date(df, date).index.tolist()
+
+
+def test_day_is_not_matched_inside_longer_days(version):
+    df = ward(["၁-၁၂-၂၀၂၅", "၁၁-၁၂-၂၀၂၅", "၂၁-၁၂-၂၀၂၅"], [None] * 3, [None] * 3, version)
+
+    assert matched(df, "၁-၁၂-၂၀၂၅") == [0]
+    assert matched(df, "၁၁-၁၂-၂၀၂၅") == [1]
+    assert matched(df, "၂၁-၁၂-၂၀၂၅") == [2]
+
+
+def test_month_is_not_matched_inside_longer_months(version):
+    df = ward(["၁-၁-၂၀၂၅", "၁-၁၁-၂၀၂၅", "၁-၁၂-၂၀၂၅"], [None] * 3, [None] * 3, version)
+
+    assert matched(df, "၁-၁-၂၀၂၅") == [0]
+
+
+def test_any_date_column_matches(version):
+    df = ward(["၁-၁၂-၂၀၂၅", "၂-၁၂-၂၀၂၅", "၃-၁၂-၂၀၂၅", "၄-၁၂-၂၀၂၅"],
+              [None, "၁-၁၂-၂၀၂၅", None, None],
+              [None, None, "၁-၁၂-၂၀၂၅", None], version)
+
+    assert matched(df, "၁-၁၂-၂၀၂၅") == [0, 1, 2]
+
+
+def test_two_digit_years(version):
+    df = ward(["1-12-25", "၀၁-၁၂-၂၅", "1-12-2024", "1-12-2025"], [None] * 4, [None] * 4, version)
+
+    assert matched(df, "၁-၁၂-၂၀၂၅") == [0, 1, 3]
+    assert matched(df, "1-12-25") == [0, 1, 3]
+
+
+def test_exp_and_die_cells(version):
+    df = ward(["၁-၁၂-၂၀၂၅", "၂-၁၂-၂၀၂၅", "၃-၁၂-၂၀၂၅", "၄-၁၂-၂၀၂၅"],
+              ["exp", "exp ၁-၁၂-၂၀၂၅", "die", "Die(၁-၁၂-၂၀၂၅)"],
+              [None] * 4, version)
+
+    # A bare note has no date; a note around a date still dates the row
+    assert matched(df, "၁-၁၂-၂၀၂၅") == [0, 1, 3]
+
+
+def test_non_date_cells_never_match(version):
+    df = ward(["၁-၁၂-၂၀၂၅", "", "abc", 20251201, "၁၁-၁၂-၂၀၂၅၅", "31-2-2025"],
+              [None] * 6, [None] * 6, version)
+
+    assert matched(df, "၁-၁၂-၂၀၂၅") == [0]
+    assert matched(df, "31-2-2025") == []
+
+
+def test_unparseable_wanted_date_matches_nothing(version):
+    df = ward(["၁-၁၂-၂၀၂၅"], ["exp"], [None], version)
+
+    assert logic.rows_on_date(df, "exp").empty
+    assert logic.rows_on_date(df, "").empty
+
+
+def test_index_follows_row_labels_of_filtered_frames():
+    df = ward(["၁-၁၂-၂၀၂၅", "၂-၁၂-၂၀၂၅", "၁-၁၂-၂၀၂၅"], [None] * 3, [None] * 3, "filtered")
+
+    assert matched(df.iloc[1:], "၁-၁၂-၂၀၂၅") == [2]
+
+
+def test_equal_length_slices_do_not_share_an_index():
+    df = ward(["၁-၁၂-၂၀၂၅", "၂-၁၂-၂၀၂၅", "၃-၁၂-၂၀၂၅"], [None] * 3, [None] * 3, "slices")
+
+    # Both slices inherit the workbook version and have two rows
+    assert matched(df.iloc[:2], "၁-၁၂-၂၀၂၅") == [0]
+    assert matched(df.iloc[1:], "၃-၁၂-၂၀၂၅") == [2]
+    assert matched(df.iloc[1:], "၁-၁၂-၂၀၂၅") == []
+    assert matched(df, "၃-၁၂-၂၀၂၅") == [2]
@@ -0,0 +1,170 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from telegram.error import RetryAfter
+
+from artifacts import Artifact
+from delivery import BEST_EFFORT, TelegramRateLimiter, Throttled, TokenBucket, send_documents
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_bursts_then_spaces_reservations():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=3, clock=clock)
+
+    assert [bucket.reserve() for _ in range(5)] == [0, 0, 0, 0.5, 1.0]
+    clock.now += 1
+    # Two tokens came back, which pays off the debt
+    assert bucket.delay() == 0.5
+    bucket.pause(2)
+    assert bucket.reserve() == 2.5
+
+
+def send_all(limiter, calls, chat_id=42, endpoint="sendMessage", rate_limit_args=None):
+    """Sends each fake callback through the limiter concurrently; returns when each one ran"""
+    started = time.monotonic()
+    sent = []
+
+    def callback(result):
+        async def call():
+            outcome = result() if callable(result) else result
+            sent.append(time.monotonic() - started)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        return call
+
+    async def run():
+        return await asyncio.gather(*(
+            limiter.process_request(callback(result), (), {}, endpoint, {"chat_id": chat_id}, rate_limit_args)
+            for result in calls
+        ), return_exceptions=True)
+
+    return asyncio.run(run()), sent
+
+
+def test_chat_sends_are_spaced_after_the_burst():
+    limiter = TelegramRateLimiter(global_rate=1000, chat_rate=20, chat_burst=2)
+
+    results, sent = send_all(limiter, range(5))
+
+    assert results == list(range(5))
+    # Two go out at once, then one every 1/20 s
+    assert sent[1] < 0.03
+    for earlier, later in zip(sent[1:], sent[2:]):
+        assert later - earlier >= 0.04
+    assert sent[-1] >= 0.14
+
+
+def _echo(value):
+    async def call():
+        return value
+    return call
+
+
+def test_other_chats_are_not_held_back():
+    limiter = TelegramRateLimiter(global_rate=1000, chat_rate=1, chat_burst=1)
+
+    async def run():
+        busy = [limiter.process_request(_echo(i), (), {}, "sendMessage", {"chat_id": 1}, None) for i in range(2)]
+        task = asyncio.gather(*busy)
+        start = time.monotonic()
+        await limiter.process_request(_echo("other"), (), {}, "sendMessage", {"chat_id": "2"}, None)
+        elapsed = time.monotonic() - start
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return elapsed
+
+    assert asyncio.run(run()) < 0.1
+
+
+def test_retry_after_is_retried_then_reraised():
+    limiter = TelegramRateLimiter(global_rate=1000, chat_rate=1000, chat_burst=10, max_retries=2)
+    attempts = []
+
+    def flood_once():
+        attempts.append(1)
+        return RetryAfter(0.05) if len(attempts) == 1 else "sent"
+
+    results, sent = send_all(limiter, [flood_once])
+    assert results == ["sent"]
+    assert len(attempts) == 2
+    # The retry waited for the flood wait Telegram asked for
+    assert sent[1] - sent[0] >= 0.04
+
+    flood = RetryAfter(0.01)
+    results, sent = send_all(limiter, [flood])
+    # max_retries=2: the first send and two retries, then the error reaches the caller
+    assert results == [flood]
+    assert len(sent) == 3
+
+
+def test_best_effort_is_dropped_when_the_chat_bucket_is_empty():
+    limiter = TelegramRateLimiter(global_rate=1000, chat_rate=1, chat_burst=2)
+
+    results, _ = send_all(limiter, ["first"], rate_limit_args=BEST_EFFORT)
+    assert results == ["first"]
+
+    # The bucket is down to its last token, which is kept for a message that has to go out
+    results, sent = send_all(limiter, ["edit"], rate_limit_args=BEST_EFFORT)
+    assert isinstance(results[0], Throttled)
+    assert sent == []
+
+    results, _ = send_all(limiter, ["reply"])
+    assert results == ["reply"]
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+        self._next = 0
+
+    def _message(self):
+        self._next += 1
+        return SimpleNamespace(document=SimpleNamespace(file_id=f"file-{self._next}"))
+
+    async def send_document(self, chat_id, document, filename=None, caption=None):
+        self.calls.append(("document", [document], [caption]))
+        return self._message()
+
+    async def send_media_group(self, chat_id, media):
+        self.calls.append(("album", [item.media for item in media], [item.caption for item in media]))
+        return [self._message() for _ in media]
+
+
+def test_albums_record_file_ids_and_resend_by_them():
+    bot = FakeBot()
+    artifacts = [Artifact(f"tatsin_{i}.png", b"png") for i in range(12)]
+
+    asyncio.run(send_documents(bot, 42, artifacts, caption="Done"))
+
+    assert [(kind, len(items)) for kind, items, _ in bot.calls] == [("album", 10), ("album", 2)]
+    assert bot.calls[1][2] == [None, "Done"]
+    assert [a.file_id for a in artifacts] == [f"file-{i}" for i in range(1, 13)]
+
+    bot.calls.clear()
+    asyncio.run(send_documents(bot, 42, artifacts))
+
+    # Known files go by file_id and keep the id they already had
+    assert bot.calls[0][1] == [f"file-{i}" for i in range(1, 11)]
+    assert bot.calls[1][1] == ["file-11", "file-12"]
+    assert [a.file_id for a in artifacts] == [f"file-{i}" for i in range(1, 13)]
+
+
+def test_single_file_goes_as_a_document():
+    bot = FakeBot()
+    artifact = Artifact("room.xlsx", b"xlsx")
+
+    asyncio.run(send_documents(bot, 42, [artifact], caption="Done"))
+    asyncio.run(send_documents(bot, 42, [artifact]))
+
+    assert bot.calls == [("document", [b"xlsx"], ["Done"]), ("document", ["file-1"], [None])]
+    assert artifact.file_id == "file-1"
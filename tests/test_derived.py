@@ -0,0 +1,61 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+import logic
+
+
+def versioned(version):
+    df = pd.DataFrame({"a": [1, 2, 3]})
+    logic._mark_loaded(df, version)
+    return df
+
+
+def test_concurrent_callers_build_once():
+    df = versioned("single-flight")
+    calls = []
+
+    def builder(frame):
+        calls.append(threading.get_ident())
+        time.sleep(0.05)
+        return object()
+
+    with ThreadPoolExecutor(8) as pool:
+        values = list(pool.map(lambda _: logic._derived(df, 'slow', builder), range(8)))
+
+    assert len(calls) == 1
+    assert all(value is values[0] for value in values)
+
+
+def test_failed_build_reaches_waiters_and_is_retried():
+    df = versioned("failing")
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing(frame):
+        started.set()
+        release.wait()
+        raise ValueError("bad workbook")
+
+    with ThreadPoolExecutor(2) as pool:
+        owner = pool.submit(logic._derived, df, 'flaky', failing)
+        started.wait()
+        waiter = pool.submit(logic._derived, df, 'flaky', lambda frame: "never built")
+        time.sleep(0.05)
+        release.set()
+        for future in (owner, waiter):
+            with pytest.raises(ValueError):
+                future.result()
+
+    assert logic._derived(df, 'flaky', lambda frame: "rebuilt") == "rebuilt"
+
+
+def test_frames_without_version_are_not_cached():
+    df = pd.DataFrame({"a": [1]})
+    calls = []
+    for _ in range(2):
+        logic._derived(df, 'plain', lambda frame: calls.append(1))
+    assert len(calls) == 2
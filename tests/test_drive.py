@@ -0,0 +1,137 @@
+import hashlib
+import os
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from drive import WorkbookCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _Call:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self, **kwargs):
+        return self.result
+
+
+class _MediaHttp:
+    """Serves the Range requests MediaIoBaseDownload makes, or fails them"""
+
+    def __init__(self, content, fail):
+        self.content = content
+        self.fail = fail
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        if self.fail:
+            return httplib2.Response({"status": "404"}), b"File not found"
+        start, end = map(int, headers["range"].split("=", 1)[1].split("-"))
+        chunk = self.content[start:end + 1]
+        response = httplib2.Response({
+            "status": "206",
+            "content-range": f"bytes {start}-{start + len(chunk) - 1}/{len(self.content)}",
+        })
+        return response, chunk
+
+
+class FakeDrive:
+    """files().get / files().get_media over in-memory content, counting the calls"""
+
+    def __init__(self, content=b"v1"):
+        self.content = content
+        self.fail_downloads = False
+        self.metadata_calls = 0
+        self.downloads = 0
+
+    def files(self):
+        return self
+
+    def get(self, fileId, fields=None):
+        self.metadata_calls += 1
+        return _Call({"md5Checksum": hashlib.md5(self.content).hexdigest(), "modifiedTime": "2025-12-31T00:00:00Z"})
+
+    def get_media(self, fileId):
+        self.downloads += 1
+        return HttpRequest(_MediaHttp(self.content, self.fail_downloads), None,
+                           f"https://drive.invalid/{fileId}?alt=media", headers={})
+
+
+@pytest.fixture
+def drive():
+    return FakeDrive()
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(tmp_path, drive, clock):
+    return WorkbookCache(service_factory=lambda: drive, cache_dir=str(tmp_path), max_age=60, clock=clock)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_fresh_hit_makes_no_drive_call(cache, drive, clock):
+    first = cache.get("wb")
+    clock.now += 59
+    second = cache.get("wb")
+
+    assert second is first
+    assert drive.metadata_calls == 1
+    assert drive.downloads == 1
+
+
+def test_unchanged_version_only_revalidates_metadata(cache, drive, clock):
+    first = cache.get("wb")
+    clock.now += 61
+    second = cache.get("wb")
+
+    assert second.path == first.path
+    assert second.checked_at == clock.now
+    assert drive.metadata_calls == 2
+    assert drive.downloads == 1
+
+
+def test_new_version_is_downloaded_keeping_the_previous_one(cache, drive, clock, tmp_path):
+    paths = []
+    for content in [b"v1", b"v2", b"v3"]:
+        drive.content = content
+        entry = cache.get("wb")
+        assert read(entry.path) == content
+        paths.append(entry.path)
+        clock.now += 61
+
+    assert drive.downloads == 3
+    assert len(set(paths)) == 3
+    # The current and the previous version stay on disk, older ones are pruned
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(p) for p in paths[1:])
+
+
+def test_failed_download_leaves_no_part_file(cache, drive, clock, tmp_path):
+    first = cache.get("wb")
+    clock.now += 61
+    drive.content = b"v2"
+    drive.fail_downloads = True
+
+    with pytest.raises(HttpError):
+        cache.get("wb")
+
+    assert os.listdir(tmp_path) == [os.path.basename(first.path)]
+    # The failed attempt did not replace the cached entry
+    drive.fail_downloads = False
+    assert read(cache.get("wb").path) == b"v2"
@@ -0,0 +1,164 @@
+import asyncio
+
+from jobs import JobQueue
+
+
+class FakeSubscriber:
+    def __init__(self, name, fail_raises=False):
+        self.name = name
+        self.fail_raises = fail_raises
+        self.messages = []
+        self.failures = []
+        self.results = []
+
+    async def progress(self, text):
+        self.messages.append(text)
+
+    async def fail(self, exc):
+        self.failures.append(exc)
+        if self.fail_raises:
+            raise RuntimeError("chat is gone")
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_duplicate_keys_in_flight_share_one_job():
+    calls = []
+
+    async def scenario():
+        queue = JobQueue(workers=1)
+        queue.start()
+        gate = asyncio.Event()
+
+        async def work(job):
+            calls.append(job.key)
+            await gate.wait()
+            for subscriber in job.close():
+                subscriber.results.append("report")
+
+        first, second = FakeSubscriber("a"), FakeSubscriber("b")
+        job, is_new = await queue.submit("tatsin", work, first)
+        merged, merged_is_new = await queue.submit("tatsin", work, second)
+        gate.set()
+        await queue.join()
+        await queue.stop()
+        return job, is_new, merged, merged_is_new, first, second, queue
+
+    job, is_new, merged, merged_is_new, first, second, queue = run(scenario())
+
+    assert is_new and not merged_is_new
+    assert merged is job
+    assert calls == ["tatsin"]
+    assert first.results == second.results == ["report"]
+    assert second.messages == ["Same report is already being generated, you'll get it too."]
+    assert queue._inflight == {}
+
+
+def test_close_stops_merging_into_the_job():
+    calls = []
+
+    async def scenario():
+        queue = JobQueue(workers=1)
+        queue.start()
+        closed = asyncio.Event()
+        release = asyncio.Event()
+
+        async def work(job):
+            calls.append(job)
+            job.close()
+            closed.set()
+            # Still running (e.g. uploading) after handing out its subscribers
+            await release.wait()
+
+        await queue.submit("room", work, FakeSubscriber("a"))
+        await closed.wait()
+        later, is_new = await queue.submit("room", work, FakeSubscriber("b"))
+        release.set()
+        await queue.join()
+        await queue.stop()
+        return later, is_new, queue
+
+    later, is_new, queue = run(scenario())
+
+    assert is_new
+    assert len(calls) == 2 and calls[1] is later and calls[0] is not later
+    assert queue._inflight == {}
+
+
+def test_failure_before_close_reaches_every_subscriber():
+    async def scenario():
+        queue = JobQueue(workers=1)
+        queue.start()
+        gate = asyncio.Event()
+        error = ValueError("workbook unreadable")
+
+        async def work(job):
+            await gate.wait()
+            raise error
+
+        subscribers = [FakeSubscriber("a", fail_raises=True), FakeSubscriber("b"), FakeSubscriber("c")]
+        for subscriber in subscribers:
+            await queue.submit("sitchar", work, subscriber)
+        gate.set()
+        await queue.join()
+        await queue.stop()
+        return error, subscribers, queue
+
+    error, subscribers, queue = run(scenario())
+
+    # One subscriber's failing notice does not keep the others from theirs
+    assert all(subscriber.failures == [error] for subscriber in subscribers)
+    assert queue._inflight == {}
+
+
+def test_failure_after_close_notifies_nobody():
+    async def scenario():
+        queue = JobQueue(workers=1)
+        queue.start()
+
+        async def work(job):
+            job.close()
+            raise ValueError("upload failed")
+
+        subscriber = FakeSubscriber("a")
+        await queue.submit("tatsin", work, subscriber)
+        await queue.join()
+        await queue.stop()
+        return subscriber
+
+    assert run(scenario()).failures == []
+
+
+def test_queue_reports_jobs_ahead_and_drains():
+    order = []
+
+    async def scenario():
+        queue = JobQueue(workers=1)
+        queue.start()
+        gate = asyncio.Event()
+
+        async def work(job):
+            await gate.wait()
+            order.append(job.key)
+            job.close()
+
+        subscribers = [FakeSubscriber(str(i)) for i in range(3)]
+        for i, subscriber in enumerate(subscribers):
+            await queue.submit(f"key-{i}", work, subscriber)
+            # Let the worker take the first job off the queue
+            await asyncio.sleep(0)
+        gate.set()
+        # join() returns only once every job called task_done
+        await asyncio.wait_for(queue.join(), timeout=1)
+        await queue.stop()
+        return subscribers, queue
+
+    subscribers, queue = run(scenario())
+
+    assert order == ["key-0", "key-1", "key-2"]
+    assert subscribers[0].messages == subscribers[1].messages == []
+    assert subscribers[2].messages == ["Queued, 1 job(s) ahead."]
+    assert queue._inflight == {}
+    assert queue._tasks == []
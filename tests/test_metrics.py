@@ -0,0 +1,74 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import metrics
+from metrics import Registry, request_log, run_in_context
+
+
+def test_counter_labels_are_rendered_sorted_and_escaped():
+    registry = Registry()
+    registry.inc("cache_requests_total", cache="workbook", result="fresh")
+    registry.inc("cache_requests_total", result="fresh", cache="workbook")
+    registry.inc("cache_requests_total", cache='say "hi"\n', result="miss")
+    registry.inc("jobs_total")
+
+    lines = registry.render().splitlines()
+
+    assert lines.count("# TYPE bot_cache_requests_total counter") == 1
+    assert 'bot_cache_requests_total{cache="workbook",result="fresh"} 2' in lines
+    assert 'bot_cache_requests_total{cache="say \\"hi\\"\\n",result="miss"} 1' in lines
+    assert "bot_jobs_total 1" in lines
+
+
+def test_histogram_buckets_are_cumulative_up_to_inf():
+    registry = Registry(buckets=(0.1, 1))
+    for seconds in (0.05, 0.1, 0.5, 5):
+        registry.observe("report.job", seconds)
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE bot_stage_seconds histogram" in lines
+    assert 'bot_stage_seconds_bucket{stage="report.job",le="0.1"} 2' in lines
+    assert 'bot_stage_seconds_bucket{stage="report.job",le="1"} 3' in lines
+    assert 'bot_stage_seconds_bucket{stage="report.job",le="+Inf"} 4' in lines
+    assert 'bot_stage_seconds_sum{stage="report.job"} 5.65' in lines
+    assert 'bot_stage_seconds_count{stage="report.job"} 4' in lines
+
+
+def test_failing_span_counts_a_stage_error():
+    registry = Registry()
+    with registry.span("drive.download"):
+        pass
+    with pytest.raises(ValueError):
+        with registry.span("drive.download"):
+            raise ValueError("timeout")
+
+    snapshot = registry.snapshot()
+
+    assert snapshot["stages"]["drive.download"]["count"] == 2
+    assert snapshot["counters"][("stage_errors_total", (("stage", "drive.download"),))] == 1
+
+
+def test_worker_thread_spans_reach_the_request_log(monkeypatch, capsys):
+    monkeypatch.setattr(metrics, "METRICS_JSON_LOGS", True)
+
+    def render(stage):
+        with metrics.span(stage):
+            pass
+
+    with ThreadPoolExecutor(2) as pool:
+        with request_log("report_job", key="tatsin"):
+            with metrics.span("report.workbook"):
+                pass
+            run_in_context(pool, render, "report.tatsin").result()
+            # A bare submit runs outside the request context
+            pool.submit(render, "report.elsewhere").result()
+
+    record = json.loads(capsys.readouterr().out.strip())
+
+    assert record["event"] == "report_job"
+    assert record["key"] == "tatsin"
+    assert [s["stage"] for s in record["spans"]] == ["report.workbook", "report.tatsin"]
+    assert all(s["error"] is False for s in record["spans"])
@@ -0,0 +1,111 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import logic
+
+UNITS = [f"ခလရ {n}" for n in range(1, 9)]
+ROOMS = ["A1", "A2", "B1", "B2"]
+DIAGNOSES = ["EAMI", "easpw", "EAGSW wound", "Malaria", "Fever", None]
+
+
+def ward(rows, seed=0, units=UNITS):
+    rnd = random.Random(seed)
+    return pd.DataFrame({
+        "ကိုယ်ပိုင်အမှတ်": [None if rnd.random() < 0.05 else f"ကြည်း-{seed}-{i}" for i in range(rows)],
+        "ဆေးရုံဆင်းရက်": [rnd.choice([None, None, None, "၁-၁၂-၂၀၂၅", "exp"]) for _ in range(rows)],
+        "ဆေးရုံပြောင်းရက်": [rnd.choice([None, None, None, "၂-၁၂-၂၀၂၅"]) for _ in range(rows)],
+        "ရောဂါ(အဂ်လိပ်)": [rnd.choice(DIAGNOSES) for _ in range(rows)],
+        "တပ်": [None if rnd.random() < 0.05 else rnd.choice(units) for _ in range(rows)],
+        "room": [None if rnd.random() < 0.1 else rnd.choice(ROOMS) for _ in range(rows)],
+    })
+
+
+def loaded(df, version):
+    """The frame the way load_dataframe hands it out"""
+    df = logic.compact_dataframe(df.copy())
+    logic._mark_loaded(df, version)
+    return df
+
+
+def pivot_table_reports(df):
+    """sitchar and room the way they were built with pd.pivot_table"""
+    admitted = df[df[['ဆေးရုံဆင်းရက်', 'ဆေးရုံပြောင်းရက်']].isna().all(axis=1)].copy()
+    is_operation = admitted['ရောဂါ(အဂ်လိပ်)'].astype(object).str.contains(logic.OPERATION_PATTERN, case=False, na=False)
+    admitted['group'] = np.where(is_operation, 'စဆရ', 'အခြား')
+    admitted['room'] = admitted['room'].astype(object)
+    admitted['တပ်'] = admitted['တပ်'].astype(object)
+    pivots = []
+    for by in ['group', 'room']:
+        pivot = pd.pivot_table(admitted, index=by, columns='တပ်', values='ကိုယ်ပိုင်အမှတ်', aggfunc='count', fill_value=0)
+        pivot.loc['ပေါင်း'] = pivot.sum()
+        pivot['ပေါင်း'] = pivot.sum(axis=1)
+        pivot.index.name = None
+        pivot.columns.name = None
+        pivots.append(pivot)
+    return pivots
+
+
+def aggregate_reports(df):
+    """sitchar and room cut from admitted_counts, filtered the way _gen_sitchar/_gen_room do"""
+    counts = logic.admitted_counts(df)
+    counts = counts[counts['unit'].notna()]
+    return [logic.admitted_pivot(counts, 'group'), logic.admitted_pivot(counts[counts['room'].notna()], 'room')]
+
+
+def assert_matches_pivot_table(df):
+    for expected, actual in zip(pivot_table_reports(df), aggregate_reports(df)):
+        pd.testing.assert_frame_equal(expected, actual, check_dtype=False)
+
+
+@pytest.fixture
+def counted(monkeypatch):
+    """Row counts of every _count_admitted call, to tell a full build from an appended-rows one"""
+    calls = []
+    count_admitted = logic._count_admitted
+
+    def spy(df):
+        calls.append(len(df))
+        return count_admitted(df)
+
+    monkeypatch.setattr(logic, "_count_admitted", spy)
+    monkeypatch.setattr(logic, "_last_aggregate", None)
+    return calls
+
+
+def test_full_build_matches_pivot_table(counted):
+    df = loaded(ward(300), "pivots-full")
+
+    assert_matches_pivot_table(df)
+    assert counted == [300]
+
+
+def test_plain_frames_match_pivot_table():
+    assert_matches_pivot_table(ward(300, seed=1))
+
+
+def test_appended_rows_extend_the_previous_version(counted):
+    rows = pd.concat([ward(300, seed=2), ward(20, seed=3, units=UNITS + ["တပ 99"])], ignore_index=True)
+    old = loaded(rows.iloc[:300], "pivots-base")
+    new = loaded(rows, "pivots-appended")
+
+    logic.admitted_counts(old)
+    assert_matches_pivot_table(new)
+    # Only the 20 appended rows were counted for the new version
+    assert counted == [300, 20]
+
+
+def test_changed_prefix_row_forces_a_full_recompute(counted):
+    rows = pd.concat([ward(300, seed=4), ward(20, seed=5)], ignore_index=True)
+    old = loaded(rows.iloc[:300], "pivots-before-discharge")
+    logic.admitted_counts(old)
+
+    # A patient admitted in the old version has since been discharged
+    still_admitted = rows.index[:300][rows.iloc[:300][['ဆေးရုံဆင်းရက်', 'ဆေးရုံပြောင်းရက်']].isna().all(axis=1)]
+    rows.loc[still_admitted[0], 'ဆေးရုံဆင်းရက်'] = "၃-၁၂-၂၀၂၅"
+    new = loaded(rows, "pivots-after-discharge")
+
+    assert_matches_pivot_table(new)
+    assert counted == [300, 320]
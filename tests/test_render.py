@@ -0,0 +1,65 @@
+import io
+
+import pandas as pd
+
+from render import FallbackRenderer, Renderer, RendererUnavailable
+
+
+class FakeRenderer(Renderer):
+    def __init__(self, name, error=None):
+        self.name = name
+        self.error = error
+        self.calls = 0
+
+    def render_table(self, frame, title, output, index=True):
+        self.calls += 1
+        output.write(b"partial")
+        if self.error is not None:
+            raise self.error
+        output.seek(0)
+        output.truncate()
+        output.write(self.name.encode())
+
+
+FRAME = pd.DataFrame({"a": [1]})
+
+
+def render(renderer):
+    output = io.BytesIO()
+    renderer.render_table(FRAME, "title", output)
+    return output.getvalue()
+
+
+def test_unavailable_primary_is_dropped_on_first_render_without_warm_up():
+    primary = FakeRenderer("pillow", RendererUnavailable("no libraqm"))
+    fallback = FakeRenderer("wkhtml")
+    renderer = FallbackRenderer(primary, fallback)
+
+    assert render(renderer) == b"wkhtml"
+    assert render(renderer) == b"wkhtml"
+    assert primary.calls == 1
+    assert renderer.name == "wkhtml"
+
+
+def test_failing_table_falls_back_but_keeps_the_primary():
+    primary = FakeRenderer("pillow", ValueError("bad table"))
+    fallback = FakeRenderer("wkhtml")
+    renderer = FallbackRenderer(primary, fallback)
+
+    assert render(renderer) == b"wkhtml"
+    assert render(renderer) == b"wkhtml"
+    assert primary.calls == 2
+    assert renderer.primary is primary
+
+
+def test_warm_up_drops_an_unavailable_primary():
+    class Unavailable(FakeRenderer):
+        def warm_up(self):
+            raise RendererUnavailable("no libraqm")
+
+    primary = Unavailable("pillow")
+    renderer = FallbackRenderer(primary, FakeRenderer("wkhtml"))
+    renderer.warm_up()
+
+    assert render(renderer) == b"wkhtml"
+    assert primary.calls == 0
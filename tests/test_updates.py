@@ -0,0 +1,123 @@
+import asyncio
+import random
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+
+from updates import ChatOrderedUpdateProcessor
+
+
+def make_update(update_id, chat_id, kind):
+    return SimpleNamespace(update_id=update_id, kind=kind, effective_chat=SimpleNamespace(id=chat_id))
+
+
+def make_processor(max_concurrent=4, budgets=None):
+    return ChatOrderedUpdateProcessor(max_concurrent, budgets=budgets, classify=lambda update: update.kind)
+
+
+class Recorder:
+    """Fake handlers that log when each update starts and finishes, and the peak concurrency overall and per kind"""
+
+    def __init__(self, seed=0):
+        self.rnd = random.Random(seed)
+        self.events = []
+        self.running = Counter()
+        self.peak = Counter()
+
+    async def handle(self, update):
+        self.events.append(("start", update.effective_chat.id, update.update_id))
+        for key in ("all", update.kind):
+            self.running[key] += 1
+            self.peak[key] = max(self.peak[key], self.running[key])
+        await asyncio.sleep(self.rnd.uniform(0, 0.01))
+        for key in ("all", update.kind):
+            self.running[key] -= 1
+        self.events.append(("finish", update.effective_chat.id, update.update_id))
+
+
+def test_chat_order_concurrency_limit_and_budgets():
+    processor = make_processor(max_concurrent=4, budgets={"report": 1, "chat": 3})
+    recorder = Recorder()
+    updates = [make_update(i, chat_id=i % 5, kind="report" if i % 3 == 0 else "chat") for i in range(60)]
+
+    async def run():
+        await asyncio.gather(*(processor.process_update(u, recorder.handle(u)) for u in updates))
+
+    asyncio.run(run())
+
+    per_chat = defaultdict(list)
+    for event, chat_id, update_id in recorder.events:
+        per_chat[chat_id].append((event, update_id))
+    for chat_id, events in per_chat.items():
+        # Strictly one at a time and in arrival order: start a, finish a, start b, finish b, ...
+        expected = [u.update_id for u in updates if u.effective_chat.id == chat_id]
+        assert events == [(event, i) for i in expected for event in ("start", "finish")]
+
+    assert 1 < recorder.peak["all"] <= 4
+    assert recorder.peak["report"] == 1
+    assert recorder.peak["chat"] <= 3
+    assert processor._chats == {}
+    assert processor.running == 0
+
+
+def test_updates_without_chat_are_not_serialised():
+    processor = make_processor(max_concurrent=3)
+    recorder = Recorder()
+    updates = [SimpleNamespace(update_id=i, kind=None, effective_chat=None) for i in range(6)]
+
+    async def handle(update):
+        recorder.running["all"] += 1
+        recorder.peak["all"] = max(recorder.peak["all"], recorder.running["all"])
+        await asyncio.sleep(0.01)
+        recorder.running["all"] -= 1
+
+    async def run():
+        await asyncio.gather(*(processor.process_update(u, handle(u)) for u in updates))
+
+    asyncio.run(run())
+
+    assert recorder.peak["all"] == 3
+
+
+def test_cancelled_waiters_leave_no_chat_state():
+    processor = make_processor(max_concurrent=2, budgets={"report": 1})
+    started = []
+
+    async def run():
+        gate = asyncio.Event()
+
+        async def blocking(update):
+            started.append(update.update_id)
+            await gate.wait()
+
+        async def never(update):
+            started.append(update.update_id)
+
+        first = make_update(1, chat_id=7, kind="report")
+        # Waits for chat 7's turn
+        same_chat = make_update(2, chat_id=7, kind="chat")
+        # Has its chat turn but waits for the report budget
+        same_kind = make_update(3, chat_id=8, kind="report")
+
+        holder = asyncio.create_task(processor.process_update(first, blocking(first)))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(processor.process_update(u, never(u))) for u in (same_chat, same_kind)]
+        await asyncio.sleep(0.01)
+        assert set(processor._chats) == {7, 8}
+
+        for task in waiters:
+            task.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        assert list(processor._chats) == [7]
+
+        gate.set()
+        await holder
+
+        # The chat and the budget are usable again
+        later = make_update(4, chat_id=7, kind="report")
+        await processor.process_update(later, never(later))
+
+    asyncio.run(run())
+
+    assert started == [1, 4]
+    assert processor._chats == {}
+    assert processor.running == 0
@@ -0,0 +1,97 @@
+import asyncio
+import os
+
+from telegram.ext import BaseUpdateProcessor
+
+# --- CONFIGURATION ---
+# Updates accepted at once, including those waiting behind earlier updates of their chat
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "256"))
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Runs updates concurrently while each chat's updates run one at a time, in arrival order.
+
+    `classify(update)` names the kind of an update (e.g. "report" or "chat") or returns None;
+    kinds listed in `budgets` may only run that many at once, so one kind cannot take every
+    slot from the others. The order is: chat turn, then the kind's budget, then one of the
+    `max_concurrent` running slots, so waiting updates never hold a running slot.
+    """
+
+    def __init__(self, max_concurrent, budgets=None, classify=None, max_pending=UPDATE_MAX_PENDING):
+        super().__init__(max(max_pending, max_concurrent))
+        self.max_concurrent = max_concurrent
+        self.classify = classify or (lambda update: None)
+        self.budgets = dict(budgets or {})
+        self._running = asyncio.Semaphore(max_concurrent)
+        self._kinds = {kind: asyncio.Semaphore(limit) for kind, limit in self.budgets.items()}
+        # chat id -> [lock, updates holding or waiting for it]
+        self._chats = {}
+        self.running = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @staticmethod
+    def _chat_id(update):
+        chat = getattr(update, "effective_chat", None)
+        return chat.id if chat else None
+
+    async def _chat_turn(self, chat_id):
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            entry = self._chats[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock hands over in FIFO order, and an uncontended acquire does not yield,
+            # so updates take their turn in the order they reached the processor
+            await entry[0].acquire()
+        except BaseException:
+            self._release_chat(chat_id, entry, locked=False)
+            raise
+        return entry
+
+    def _release_chat(self, chat_id, entry, locked=True):
+        if locked:
+            entry[0].release()
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._chats[chat_id]
+
+    async def do_process_update(self, update, coroutine):
+        chat_id = self._chat_id(update)
+        kind = self.classify(update)
+        budget = self._kinds.get(kind)
+        try:
+            entry = await self._chat_turn(chat_id) if chat_id is not None else None
+            try:
+                if budget is not None:
+                    await budget.acquire()
+                try:
+                    async with self._running:
+                        self.running += 1
+                        try:
+                            await coroutine
+                        finally:
+                            self.running -= 1
+                finally:
+                    if budget is not None:
+                        budget.release()
+            finally:
+                if entry is not None:
+                    self._release_chat(chat_id, entry)
+        finally:
+            # Never started if we were cancelled while waiting; close it to avoid a warning
+            close = getattr(coroutine, "close", None)
+            if close is not None:
+                close()
+
+    def stats(self):
+        return {
+            "updates_running": self.running,
+            "updates_pending": self.current_concurrent_updates - self.running,
+            "chats_with_pending_updates": sum(1 for _, holders in self._chats.values() if holders > 1),
+        }